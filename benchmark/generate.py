@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+""" generates synthetic RESULT logs, JSON logs and input documents for benchmarking sqlplot """
+# pylint: disable=bad-indentation,line-too-long,invalid-name
+
+import argparse
+import json
+import random
+import typing as t
+
+""" the first keys of every generated row; they are used by the queries of the generated documents """
+FIXED_KEYS = ['algo', 'n', 'time']
+
+def key_names(keys: int) -> t.List[str]:
+	assert keys >= len(FIXED_KEYS), 'need at least %d keys' % len(FIXED_KEYS)
+	return FIXED_KEYS + list(map(lambda i: 'key%d' % i, range(len(FIXED_KEYS), keys)))
+
+def generate_rows(rows: int, keys: int, cardinality: int, seed: int = 0) -> t.Iterator[t.List[t.Tuple[str, t.Any]]]:
+	""" yields `rows` rows with `keys` key/value pairs.
+	`algo` and every third additional key are strings, `n` and every third additional key are integers, each with `cardinality` distinct values.
+	The remaining keys, including `time`, are real numbers.
+	"""
+	rng = random.Random(seed)
+	names = key_names(keys)
+	for _ in range(rows):
+		row = []
+		for i, name in enumerate(names):
+			if i % 3 == 0:
+				row.append((name, 'v%d' % rng.randrange(cardinality)))
+			elif i % 3 == 1:
+				row.append((name, rng.randrange(cardinality)))
+			else:
+				row.append((name, round(rng.random() * 1000, 4)))
+		yield row
+
+def generate_resultlog(filename: str, rows: int, keys: int, cardinality: int, seed: int = 0):
+	""" writes a log file with RESULT lines, interleaved with other output as in a real benchmark log """
+	with open(filename, 'w') as logfile:
+		for i, row in enumerate(generate_rows(rows, keys, cardinality, seed)):
+			if i % 10 == 0:
+				logfile.write('running benchmark %d\n' % i)
+			logfile.write('RESULT ' + '\t'.join(map(lambda pair: '%s=%s' % pair, row)) + '\n')
+
+def generate_jsonlog(filename: str, rows: int, keys: int, cardinality: int, seed: int = 0, lines: bool = True):
+	""" writes the rows as JSON Lines, or as a single JSON array if `lines` is not set """
+	with open(filename, 'w') as logfile:
+		if not lines:
+			logfile.write('[\n')
+		for i, row in enumerate(generate_rows(rows, keys, cardinality, seed)):
+			if not lines and i > 0:
+				logfile.write(',\n')
+			logfile.write(json.dumps(dict(row)))
+			if lines:
+				logfile.write('\n')
+		if not lines:
+			logfile.write('\n]\n')
+
+def multiplot_query(tablename: str) -> str:
+	return 'SELECT n AS x, AVG(time) AS y, MULTIPLOT FROM "%s" GROUP BY MULTIPLOT, x ORDER BY MULTIPLOT, x' % tablename
+
+def generate_document(filename: str, logfilename: str, plots: int, json_log: bool = False, outdir: t.Optional[str] = None):
+	""" writes a tex or py document (depending on the extension of `filename`) importing `logfilename` into the table `bench` with `plots` MULTIPLOT directives """
+	comment = '##' if filename.endswith('.py') else '%%'
+	with open(filename, 'w') as document:
+		document.write('%s IMPORT-%sDATA bench %s\n\n' % (comment, 'JSON-' if json_log else '', logfilename))
+		for plot in range(plots):
+			document.write('%s MULTIPLOT(algo) %s\n' % (comment, multiplot_query('bench')))
+			if outdir != None:
+				document.write('%s CONFIG file=%s/plot%d.tex type=tex\n' % (comment, outdir, plot))
+			document.write('\n')
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='generates a synthetic benchmark log and a document plotting it')
+	parser.add_argument('-r', '--rows', type=int, default=100000, help='number of rows')
+	parser.add_argument('-k', '--keys', type=int, default=8, help='number of keys per row')
+	parser.add_argument('-c', '--cardinality', type=int, default=20, help='number of distinct values of the string and integer keys')
+	parser.add_argument('-s', '--seed', type=int, default=0)
+	parser.add_argument('-f', '--format', choices=['result', 'jsonl', 'json'], default='result', help='format of the log file')
+	parser.add_argument('-o', '--output', type=str, required=True, help='log file to write')
+	parser.add_argument('-d', '--document', type=str, default='', help='also write a tex or py document plotting the log')
+	parser.add_argument('-p', '--plots', type=int, default=10, help='number of MULTIPLOT directives of the document')
+	args = parser.parse_args()
+
+	if args.format == 'result':
+		generate_resultlog(args.output, args.rows, args.keys, args.cardinality, args.seed)
+	else:
+		generate_jsonlog(args.output, args.rows, args.keys, args.cardinality, args.seed, lines=args.format == 'jsonl')
+	if args.document:
+		generate_document(args.document, args.output, args.plots, json_log=args.format != 'result')
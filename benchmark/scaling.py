@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+""" measures how the import, the query and the output of sqlplot scale with the number of rows.
+Each measurement runs in a fresh process such that its peak memory can be reported.
+The results are appended as JSON Lines to the output file to compare builds over time.
+"""
+# pylint: disable=bad-indentation,line-too-long,invalid-name
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPOSITORY_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+import generate
+
+TASKS = ['create_table', 'create_json_table', 'multiplot', 'plot_coordinates', 'render-tex', 'document-tex', 'document-py']
+
+def setup_sqlplot() -> t.Tuple[t.Any, t.Any]:
+	""" imports sqlplot and creates an engine on an in-memory database without color entries """
+	import sqlplot
+	engine = sqlplot.Engine(colors=sqlplot.ColorCache())
+	engine.config_args = { 'colorcache' : 'none' }
+	return sqlplot, engine
+
+def measure_function(task: str, logfilename: str, jsonfilename: str, documentname: t.Optional[str]) -> t.Tuple[float, int]:
+	""" runs in a fresh process: times a single function of sqlplot. Returns the seconds and the number of processed items """
+	sqlplot, engine = setup_sqlplot()
+	if task == 'render-tex':
+		""" a complete run like document-tex, but without starting an interpreter """
+		with open(os.devnull, 'w') as devnull:
+			started = time.perf_counter()
+			engine.render(documentname, devnull)
+			seconds = time.perf_counter() - started
+		with engine.activate():
+			return seconds, sqlplot.max_rowid('bench')
+	with engine.activate():
+		return measure_engine_function(sqlplot, task, logfilename, jsonfilename)
+
+def measure_engine_function(sqlplot: t.Any, task: str, logfilename: str, jsonfilename: str) -> t.Tuple[float, int]:
+	if task == 'create_json_table':
+		started = time.perf_counter()
+		sqlplot.create_json_table('bench', jsonfilename)
+		return time.perf_counter() - started, sqlplot.max_rowid('bench')
+	started = time.perf_counter()
+	sqlplot.create_table('bench', logfilename)
+	if task == 'create_table':
+		return time.perf_counter() - started, sqlplot.max_rowid('bench')
+	started = time.perf_counter()
+	coordinates = sqlplot.multiplot(generate.multiplot_query('bench'), ['algo'])
+	if task == 'multiplot':
+		return time.perf_counter() - started, sqlplot.max_rowid('bench')
+	assert task == 'plot_coordinates'
+	with tempfile.TemporaryFile('w') as outfile:
+		started = time.perf_counter()
+		sqlplot.plot_coordinates(generate.multiplot_query('bench'), 'bench.tex', coordinates, outfile, sqlplot.Filetype.TEX, 0)
+		return time.perf_counter() - started, sum(map(len, coordinates.values()))
+
+def measure_in_process(task: str, logfilename: str, jsonfilename: str, documentname: t.Optional[str]) -> t.Tuple[float, int, int]:
+	seconds, items = measure_function(task, logfilename, jsonfilename, documentname)
+	return seconds, items, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def generate_document(task: str, workdir: str, logfilename: str, rows: int, plots: int) -> str:
+	""" generates the document of a task ending with its extension, like document-tex """
+	extension = task.split('-')[1]
+	documentname = os.path.join(workdir, 'document-%d.%s' % (rows, extension))
+	generate.generate_document(documentname, logfilename, plots)
+	return documentname
+
+def measure_document(task: str, workdir: str, logfilename: str, rows: int, plots: int) -> t.Tuple[float, int, int]:
+	""" times a complete run of sqlplot.py on a generated document """
+	documentname = generate_document(task, workdir, logfilename, rows, plots)
+	started = time.perf_counter()
+	with open(os.devnull, 'w') as devnull:
+		process = subprocess.Popen([sys.executable, os.path.join(REPOSITORY_DIR, 'sqlplot.py'), '-i', documentname], stdout=devnull, stderr=devnull, cwd=workdir)
+		_, status, usage = os.wait4(process.pid, 0)
+	seconds = time.perf_counter() - started
+	assert status == 0, 'sqlplot failed on %s' % documentname
+	return seconds, rows, usage.ru_maxrss
+
+def revision() -> t.Optional[str]:
+	try:
+		return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_DIR, stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='measures the scaling of sqlplot with the number of rows')
+	parser.add_argument('-r', '--rows', type=int, nargs='+', default=[10000, 100000, 1000000, 10000000], help='numbers of rows')
+	parser.add_argument('-k', '--keys', type=int, default=8, help='number of keys per row')
+	parser.add_argument('-c', '--cardinality', type=int, default=20, help='number of distinct values of the string and integer keys')
+	parser.add_argument('-p', '--plots', type=int, default=10, help='number of MULTIPLOT directives of the generated documents')
+	parser.add_argument('-t', '--tasks', choices=TASKS, nargs='+', default=TASKS)
+	parser.add_argument('-w', '--workdir', type=str, default=os.path.join(tempfile.gettempdir(), 'sqlplot-benchmark'), help='directory for the generated files, which are reused by later runs')
+	parser.add_argument('-o', '--output', type=str, default=os.path.join(BENCHMARK_DIR, 'results.jsonl'), help='JSON Lines file the results are appended to')
+	args = parser.parse_args()
+
+	os.makedirs(args.workdir, exist_ok=True)
+	context = multiprocessing.get_context('spawn')
+	common = {
+			'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'revision' : revision(),
+			'python' : platform.python_version(),
+			'sqlite' : sqlite3.sqlite_version,
+			'keys' : args.keys,
+			'cardinality' : args.cardinality,
+			}
+	print('%-18s %10s %10s %14s %12s' % ('task', 'rows', 'time[s]', 'items/s', 'maxrss[KiB]'))
+	with open(args.output, 'a') as resultfile:
+		for rows in args.rows:
+			basename = os.path.join(args.workdir, 'bench-%d-%d-%d' % (rows, args.keys, args.cardinality))
+			logfilename = basename + '.txt'
+			jsonfilename = basename + '.jsonl'
+			if not os.path.exists(logfilename):
+				generate.generate_resultlog(logfilename, rows, args.keys, args.cardinality)
+			if 'create_json_table' in args.tasks and not os.path.exists(jsonfilename):
+				generate.generate_jsonlog(jsonfilename, rows, args.keys, args.cardinality)
+			for task in args.tasks:
+				if task.startswith('document-'):
+					seconds, items, maxrss = measure_document(task, args.workdir, logfilename, rows, args.plots)
+				else:
+					documentname = generate_document(task, args.workdir, logfilename, rows, args.plots) if task.startswith('render-') else None
+					with context.Pool(1) as pool:
+						seconds, items, maxrss = pool.apply(measure_in_process, (task, logfilename, jsonfilename, documentname))
+				result = dict(common)
+				result.update({ 'task' : task, 'rows' : rows, 'items' : items, 'seconds' : seconds, 'throughput' : items / seconds if seconds > 0 else None, 'max_rss_kib' : maxrss })
+				resultfile.write(json.dumps(result) + '\n')
+				resultfile.flush()
+				print('%-18s %10d %10.3f %14.0f %12d' % (task, rows, seconds, result['throughput'] or 0, maxrss))
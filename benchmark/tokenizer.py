@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+""" micro-benchmark comparing the fused RESULT line tokenizer with the previous split_keyvalueline/make_sqltype pair on wide RESULT lines """
+# pylint: disable=bad-indentation,line-too-long,invalid-name
+
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+import typing as t
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import sqlplot
+
+
+def legacy_split_keyvalueline(line: str) -> t.Mapping[str,str]:
+	""" the tokenizer before the fused one: slices the remaining line and runs re.match for every key """
+	attrs=dict()
+	while line.find('=') != -1:
+		key = line[:line.find('=')]
+		valuematch = re.match(r'^\S+', line[line.find('=')+1:])
+		assert valuematch, 'invalid key/value line: %s' % line
+		value = valuematch.group(0)
+		line=line[len(key)+len(value)+1:]
+		key = key.strip()
+		value = value.strip()
+		attrs[key] = value
+	return attrs
+
+def legacy_make_sqltype(obj: t.Any) -> sqlplot.sqltype:
+	try:
+		int(obj)
+		return sqlplot.sqltype.INTEGER
+	except ValueError:
+		pass
+	try:
+		float(obj)
+		return sqlplot.sqltype.REAL
+	except ValueError:
+		pass
+	return sqlplot.sqltype.TEXT
+
+def legacy_import(lines: t.List[str]) -> t.Dict[str, sqlplot.sqltype]:
+	keys : t.Dict[str, sqlplot.sqltype] = dict()
+	for line in lines:
+		attrs = legacy_split_keyvalueline(line[len('RESULT '):].strip())
+		for key in attrs:
+			keys[key] = max(legacy_make_sqltype(attrs[key]), keys.get(key, sqlplot.sqltype.INTEGER))
+	return keys
+
+def fused_import(lines: t.List[str]) -> t.Dict[str, sqlplot.sqltype]:
+	""" the type inference of TableLoader.add without the database """
+	keys : t.Dict[str, sqlplot.sqltype] = dict()
+	for line in lines:
+		attrs, types = sqlplot.tokenize_resultline(line)
+		for key in attrs:
+			keytype = keys.get(key)
+			if keytype != sqlplot.sqltype.TEXT:
+				keys[key] = sqlplot.widen_sqltype(keytype, attrs[key], types[key])
+	return keys
+
+def make_lines(rows: int, columns: int) -> t.List[str]:
+	""" creates RESULT lines with a mix of integer, real and text columns """
+	random.seed(0)
+	lines = []
+	for _ in range(rows):
+		values = []
+		for column in range(columns):
+			if column % 3 == 0:
+				value = str(random.randint(0, 1 << 30))
+			elif column % 3 == 1:
+				value = '%.4f' % random.random()
+			else:
+				value = random.choice(['english', 'dna', 'proteins', 'sources'])
+			values.append('key%d=%s' % (column, value))
+		lines.append('RESULT ' + '\t'.join(values) + '\n')
+	return lines
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='compares the RESULT line tokenizers')
+	parser.add_argument('-r', '--rows', type=int, default=2000, help='number of RESULT lines')
+	parser.add_argument('-c', '--columns', type=int, nargs='+', default=[10, 50, 200], help='numbers of key/value pairs per line')
+	parser.add_argument('-n', '--repeat', type=int, default=3, help='number of repetitions, the fastest is reported')
+	args = parser.parse_args()
+
+	print('columns\tlegacy[s]\tfused[s]\tspeedup')
+	for columns in args.columns:
+		lines = make_lines(args.rows, columns)
+		assert legacy_import(lines) == fused_import(lines)
+		legacy = min(timeit.repeat(lambda: legacy_import(lines), number=1, repeat=args.repeat))
+		fused = min(timeit.repeat(lambda: fused_import(lines), number=1, repeat=args.repeat))
+		print('%d\t%.3f\t%.3f\t%.1fx' % (columns, legacy, fused, legacy / fused))
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
-#@ converts a CSV file to the RESULT log file required as input for 
+#@ converts a CSV file to the RESULT log file required as input for IMPORT-DATA
+#@ sqlplot can also read a CSV file directly with IMPORT-CSV-DATA, which keeps values containing whitespace intact
 
 import sys
 
@@ -7,6 +8,8 @@ import argparse
 
 import codecs
 
+import csv
+
 def unescaped_str(arg_str):
     return codecs.decode(arg_str, 'unicode_escape')
 
@@ -18,13 +21,16 @@ args = parser.parse_args()
 
 outfile = sys.stdout
 if args.output:
-    outfile = open(args.output)
-
-with open(args.input) as csvfile:
-    header = [x.strip() for x in csvfile.readline().split(args.delimiter)]
-    for line in csvfile.readlines():
-        csvlist = line.split(args.delimiter)
-        print("RESULT " + "\t".join(list(map(lambda x,y: (x + "=" + y.strip()), header, csvlist))), file=outfile)
+    outfile = open(args.output, 'w')
+
+with open(args.input, newline='') as csvfile:
+    reader = csv.reader(csvfile, delimiter=args.delimiter, skipinitialspace=True)
+    header = [x.strip() for x in next(reader, [])]
+    for csvlist in reader:
+        if not csvlist:
+            continue
+        # a RESULT line separates its key=value pairs by whitespace, which therefore cannot occur in a value; empty values are left out
+        pairs = filter(lambda pair: pair[1], map(lambda x,y: (x, "_".join(y.split())), header, csvlist))
+        print("RESULT " + "\t".join(map(lambda pair: pair[0] + "=" + pair[1], pairs)), file=outfile)
 
 outfile.close()
-
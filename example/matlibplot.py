@@ -7,14 +7,16 @@ import matplotlib.pyplot as plt
 ## WHERE "action" = 'compression'
 ## AND "file"  = 'english.1024MB'
 ## GROUP BY MULTIPLOT,x ORDER BY MULTIPLOT,x
-## CONFIG file=json/low.json
+## CONFIG file=json/low.npz type=npz
 
-coordinates = eval(open('json/low.json', 'r').read())
-""" coordinates is a list whose entries have type ([String], [(Int, Int)]), where the former [String] is the name and the latter is a list of pair of x/y coordinates. """
+from sqlplot import load_npz
+
+coordinates = load_npz('json/low.npz')
+""" coordinates is a dictionary mapping the name tuple of each series to its numpy arrays of x and y coordinates. """
 
 
 for key in coordinates:
-	plt.plot(list(map(lambda row: row[0], coordinates[key])), list(map(lambda row: row[1], coordinates[key])), label = key)
+	plt.plot(coordinates[key][0], coordinates[key][1], label = key)
 
 # naming the x axis 
 plt.xlabel('x - axis') 
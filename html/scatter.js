@@ -17,16 +17,29 @@ var xCat = "x",
     // rCat = "Protein (g)",
     colorCat = "name";
 
-function read_coordinates(data) {
-  var xMax = d3.max(data, function(d) { return d[xCat]; }) * 1.05,
-      xMin = d3.min(data, function(d) { return d[xCat]; }),
-      xMin = xMin > 0 ? 0 : xMin,
-      yMax = d3.max(data, function(d) { return d[yCat]; }) * 1.05,
-      yMin = d3.min(data, function(d) { return d[yCat]; }),
-      yMin = yMin > 0 ? 0 : yMin;
+// plots with more points are drawn on a canvas instead of creating an svg element per point
+var CANVAS_THRESHOLD = 10000;
+
+// converts the columnar layout (one record per series with the arrays x and y) into one object per point
+function series_to_points(series) {
+  var points = [];
+  series.forEach(function(s) {
+    for (var i = 0; i < s.x.length; ++i) {
+      var point = {};
+      point[colorCat] = s.name;
+      point[xCat] = s.x[i];
+      point[yCat] = s.y[i];
+      points.push(point);
+    }
+  });
+  return points;
+}
 
-  x.domain([xMin, xMax]);
-  y.domain([yMin, yMax]);
+// creates the svg with the axes, the zoom behaviour and the legend of the series `names`,
+// and calls `redraw` after each zoom. Returns the svg group of the plot, the x axis, the zoom behaviour and the color scale
+function create_plot(xDomain, yDomain, names, redraw) {
+  x.domain(xDomain);
+  y.domain(yDomain);
 
   var xAxis = d3.svg.axis()
       .scale(x)
@@ -39,13 +52,7 @@ function read_coordinates(data) {
       .tickSize(-width);
 
   var color = d3.scale.category10();
-
-  var tip = d3.tip()
-      .attr("class", "d3-tip")
-      .offset([-10, 0])
-      .html(function(d) {
-        return  colorCat + ": " + d[colorCat] + "<br>" + xCat + ": " + d[xCat] + "<br>" + yCat + ": " + d[yCat];
-      });
+  names.forEach(function(name) { color(name); });
 
   var zoomBeh = d3.behavior.zoom()
       .x(x)
@@ -54,6 +61,7 @@ function read_coordinates(data) {
       .on("zoom", zoom);
 
   var svg = d3.select("#scatter")
+      .style("position", "relative")
     .append("svg")
       .attr("width", outerWidth)
       .attr("height", outerHeight)
@@ -61,8 +69,6 @@ function read_coordinates(data) {
       .attr("transform", "translate(" + margin.left + "," + margin.top + ")")
       .call(zoomBeh);
 
-  svg.call(tip);
-
   svg.append("rect")
       .attr("width", width)
       .attr("height", height);
@@ -89,6 +95,99 @@ function read_coordinates(data) {
       .style("text-anchor", "end")
       .text(yCat);
 
+  var legend = svg.selectAll(".legend")
+      .data(color.domain())
+    .enter().append("g")
+      .classed("legend", true)
+      .attr("transform", function(d, i) { return "translate(0," + i * 20 + ")"; });
+
+  legend.append("circle")
+      .attr("r", 3.5)
+      .attr("cx", width + 20)
+      .attr("fill", color);
+
+  legend.append("text")
+      .attr("x", width + 26)
+      .attr("dy", ".35em")
+      .text(function(d) { return d; });
+
+  function zoom() {
+    svg.select(".x.axis").call(xAxis);
+    svg.select(".y.axis").call(yAxis);
+    redraw();
+  }
+
+  return { svg: svg, xAxis: xAxis, zoomBeh: zoomBeh, color: color };
+}
+
+// draws the series of the columnar layout on a canvas; only the axes and the legend are svg elements
+function read_series(series) {
+  var xMax = -Infinity, xMin = Infinity, yMax = -Infinity, yMin = Infinity;
+  series.forEach(function(s) {
+    for (var i = 0; i < s.x.length; ++i) {
+      if (s.x[i] > xMax) xMax = s.x[i];
+      if (s.x[i] < xMin) xMin = s.x[i];
+      if (s.y[i] > yMax) yMax = s.y[i];
+      if (s.y[i] < yMin) yMin = s.y[i];
+    }
+  });
+  xMax *= 1.05;
+  xMin = xMin > 0 ? 0 : xMin;
+  yMax *= 1.05;
+  yMin = yMin > 0 ? 0 : yMin;
+
+  var plot = create_plot([xMin, xMax], [yMin, yMax], series.map(function(s) { return s.name; }), draw);
+  var color = plot.color;
+
+  // the canvas lies above the plot area and lets the mouse events pass to the svg for zooming
+  var canvas = d3.select("#scatter").append("canvas")
+      .attr("width", width)
+      .attr("height", height)
+      .style("position", "absolute")
+      .style("left", margin.left + "px")
+      .style("top", margin.top + "px")
+      .style("pointer-events", "none");
+  var context = canvas.node().getContext("2d");
+
+  draw();
+
+  function draw() {
+    context.clearRect(0, 0, width, height);
+    context.globalAlpha = 0.5;
+    series.forEach(function(s) {
+      context.fillStyle = color(s.name);
+      for (var i = 0; i < s.x.length; ++i) {
+        var px = x(s.x[i]), py = y(s.y[i]);
+        if (px < 0 || px > width || py < 0 || py > height) continue;
+        context.fillRect(px - 1.5, py - 1.5, 3, 3);
+      }
+    });
+  }
+}
+
+function read_coordinates(data) {
+  var xMax = d3.max(data, function(d) { return d[xCat]; }) * 1.05,
+      xMin = d3.min(data, function(d) { return d[xCat]; }),
+      xMin = xMin > 0 ? 0 : xMin,
+      yMax = d3.max(data, function(d) { return d[yCat]; }) * 1.05,
+      yMin = d3.min(data, function(d) { return d[yCat]; }),
+      yMin = yMin > 0 ? 0 : yMin;
+
+  var plot = create_plot([xMin, xMax], [yMin, yMax], d3.set(data.map(function(d) { return d[colorCat]; })).values(), zoom);
+  var svg = plot.svg,
+      xAxis = plot.xAxis,
+      zoomBeh = plot.zoomBeh,
+      color = plot.color;
+
+  var tip = d3.tip()
+      .attr("class", "d3-tip")
+      .offset([-10, 0])
+      .html(function(d) {
+        return  colorCat + ": " + d[colorCat] + "<br>" + xCat + ": " + d[xCat] + "<br>" + yCat + ": " + d[yCat];
+      });
+
+  svg.call(tip);
+
   var objects = svg.append("svg")
       .classed("objects", true)
       .attr("width", width)
@@ -119,22 +218,6 @@ function read_coordinates(data) {
       .on("mouseover", tip.show)
       .on("mouseout", tip.hide);
 
-  var legend = svg.selectAll(".legend")
-      .data(color.domain())
-    .enter().append("g")
-      .classed("legend", true)
-      .attr("transform", function(d, i) { return "translate(0," + i * 20 + ")"; });
-
-  legend.append("circle")
-      .attr("r", 3.5)
-      .attr("cx", width + 20)
-      .attr("fill", color);
-
-  legend.append("text")
-      .attr("x", width + 26)
-      .attr("dy", ".35em")
-      .text(function(d) { return d; });
-
   d3.select("input").on("click", change);
 
   function change() {
@@ -152,9 +235,6 @@ function read_coordinates(data) {
   }
 
   function zoom() {
-    svg.select(".x.axis").call(xAxis);
-    svg.select(".y.axis").call(yAxis);
-
     svg.selectAll(".dot")
         .attr("transform", transform);
   }
@@ -165,7 +245,17 @@ function read_coordinates(data) {
 }
 
 d3.json(window.location.search.substr(1), function(data) {
-  read_coordinates(data['result']);
+  if (data['series']) {
+    var points = d3.sum(data['series'], function(s) { return s.x.length; });
+    if (points > CANVAS_THRESHOLD) {
+      read_series(data['series']);
+    } else {
+      read_coordinates(series_to_points(data['series']));
+    }
+  } else {
+    // layout of older versions with an object per point
+    read_coordinates(data['result']);
+  }
   document.getElementById("sqlquery").innerHTML = data['query'];
 });
 
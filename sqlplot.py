@@ -14,9 +14,34 @@ import sys, getopt
 import re
 import os
 import json
+import hashlib
+import pickle
+import tempfile
+import filecmp
+import shutil
+import concurrent.futures
+import contextlib
+import contextvars
+import gzip
+import lzma
+import bz2
+import io
+import csv
+import codecs
+import functools
+import urllib.request
+import threading
+import collections.abc
+import time
+import random
 from enum import IntEnum, auto
 
-def die(msg):
+try:
+	import resource
+except ImportError:
+	resource = None # not available on Windows
+
+def die(msg) -> t.NoReturn:
 	print(msg, file=sys.stderr)
 	sys.exit(1)
 
@@ -30,97 +55,942 @@ class sqltype(IntEnum):
 def merge_sqltypes(obja, objb):
 	return max(obja, objb)
 
-def make_sqltype(obj: t.Any) -> sqltype:
-	try:
-		int(obj)
-		return sqltype.INTEGER
-	except ValueError:
-		pass
-	except TypeError:
-		pass
-	try: 
-		float(obj)
-		return sqltype.REAL
-	except ValueError:
-		pass
-	except TypeError:
-		pass
-	logging.debug(f"type of {obj} is TEXT")
+def make_sqltype(obj: t.Any, at_least: sqltype = sqltype.INTEGER) -> sqltype:
+	""" infers the type of a value; types smaller than `at_least` are not checked """
+	if at_least <= sqltype.INTEGER:
+		try:
+			int(obj)
+			return sqltype.INTEGER
+		except ValueError:
+			pass
+		except TypeError:
+			pass
+	if at_least <= sqltype.REAL:
+		try: 
+			float(obj)
+			return sqltype.REAL
+		except ValueError:
+			pass
+		except TypeError:
+			pass
+	logging.debug("type of %s is TEXT", obj)
 	return sqltype.TEXT
 
+def widen_sqltype(columntype: t.Optional[sqltype], value: t.Any, valuetype: t.Optional[sqltype] = None) -> sqltype:
+	""" returns the type of a column of type `columntype` (None for a new column) after adding `value`, whose type may already be known """
+	if valuetype == None:
+		return make_sqltype(value, columntype if columntype != None else sqltype.INTEGER)
+	return valuetype if columntype == None else merge_sqltypes(columntype, valuetype)
+
+""" matches a `key=value` pair. The value is captured by group 2 if it is an integer, by group 3 if it is a decimal number, and by group 4 otherwise """
+KEYVALUE_PATTERN = re.compile(r'\s*([^=]*?)\s*=(?:([-+]?\d+)|([-+]?(?:\d+\.\d*|\.\d+|\d+(?=[eE]))(?:[eE][-+]?\d+)?)|(\S*))(?=\s|$)')
+
+def tokenize_keyvalueline(line: str) -> t.Tuple[t.Dict[str,str], t.Dict[str, t.Optional[sqltype]]]:
+	""" read a line of 'key=value' pairs separated by whitespace(s) into a dict of values and a dict of their types.
+	The type is None if the value is not a plain number; then make_sqltype has to decide
+	"""
+	attrs = dict()
+	types : t.Dict[str, t.Optional[sqltype]] = dict()
+	for match in KEYVALUE_PATTERN.finditer(line):
+		kind = match.lastindex
+		""" group 1 (the key) always participates, so there is a last group """
+		assert kind != None
+		value = match.group(kind)
+		assert value, 'invalid key/value line: %s' % line
+		key = match.group(1)
+		attrs[key] = value
+		types[key] = sqltype.INTEGER if kind == 2 else sqltype.REAL if kind == 3 else None
+	return attrs, types
+
 def split_keyvalueline(line: str) -> t.Mapping[str,str]:
 	""" read a line of 'key=value' pairs separated by whitespace(s) into a dict """
-	attrs=dict()
-	while line.find('=') != -1:
-		key = line[:line.find('=')]
-		valuematch = re.match(r'^\S+', line[line.find('=')+1:])
-		assert valuematch, 'invalid key/value line: %s' % line
-		value = valuematch.group(0)
-		line=line[len(key)+len(value)+1:]
-		key = key.strip()
-		value = value.strip()
-		attrs[key] = value
-	return attrs
+	return tokenize_keyvalueline(line)[0]
 
 def split_resultline(line: str) -> t.Mapping[str,str]:
 	""" read a RESULT line and put the keyvalue pairs into a dict """
 	return split_keyvalueline(line[len('RESULT '):].strip())
 
-def create_json_table(tablename: str, tablefilename: str):
-	import json
-	with open(tablefilename,'r') as tablefile:
-		json_data = json.loads(tablefile.read())
-	keys = dict()
-	for entry in json_data:
-		for key in entry.keys():
-			if not key in keys:
-				keys[key] = make_sqltype(entry[key])
+def tokenize_resultline(line: str) -> t.Tuple[t.Dict[str,str], t.Dict[str, t.Optional[sqltype]]]:
+	""" read a RESULT line into the keyvalue pairs and their types """
+	return tokenize_keyvalueline(line[len('RESULT '):])
+
+def table_exists(tablename: str) -> bool:
+	sqlexecute('SELECT 1 FROM sqlite_master WHERE type = \'table\' AND name = \'%s\';' % tablename.replace("'", "''"))
+	return engine().cursor.fetchone() != None
+
+def max_rowid(tablename: str) -> int:
+	if not table_exists(tablename):
+		return 0
+	sqlexecute('SELECT max(rowid) FROM "%s";' % tablename)
+	rowid = engine().cursor.fetchone()[0]
+	return rowid if rowid != None else 0
+
+def table_columns(tablename: str) -> t.List[str]:
+	sqlexecute('PRAGMA table_info("%s");' % tablename)
+	return list(map(lambda row: row['name'], engine().cursor.fetchall()))
+
+""" number of rows that are buffered before they are sent to sqlite with a single executemany """
+INSERT_BATCH_SIZE = 10000
+
+class TableLoader:
+	""" streams rows of key/value pairs into the table `tablename`.
+	The rows are first stored untyped in a temporary staging table while the column types are inferred on the fly.
+	On finish, the typed table is created (or extended by the new columns) and filled from the staging table within the same transaction.
+	"""
+	tablename : str
+	schema : str
+	staging : str
+	keys : t.Dict[str, sqltype]
+	batch : t.List[t.Mapping[str, t.Any]]
+	rows : int
+	owns_transaction : bool
+
+	def __init__(self, tablename: str, schema: str = 'temp'):
+		self.tablename = tablename
+		self.schema = schema
+		self.staging = 'sqlplot_staging_' + tablename
+		self.keys = dict()
+		self.batch = []
+		self.rows = 0
+		""" if we are already inside a transaction (e.g., of the import cache), the caller commits """
+		self.owns_transaction = not engine().conn.in_transaction
+		if self.owns_transaction:
+			sqlexecute('BEGIN;')
+		sqlexecute('DROP TABLE IF EXISTS "%s"."%s";' % (self.schema, self.staging))
+
+	def add(self, attrs: t.Mapping[str, t.Any], types: t.Optional[t.Mapping[str, t.Optional[sqltype]]] = None):
+		""" adds a row given as a mapping from column names to values.
+		The types of the values can be given by `types` (see tokenize_keyvalueline).
+		A column's type only widens, hence values of a TEXT column are not inspected anymore.
+		"""
+		new_keys = []
+		for key in attrs:
+			keytype = self.keys.get(key)
+			if keytype == sqltype.TEXT:
+				continue
+			if keytype == None:
+				new_keys.append(key)
+			self.keys[key] = widen_sqltype(keytype, attrs[key], types[key] if types != None else None)
+		if new_keys:
+			self._add_columns(new_keys)
+		self.batch.append(attrs)
+		self.rows += 1
+		if len(self.batch) >= INSERT_BATCH_SIZE:
+			self.flush()
+
+	def _add_columns(self, new_keys: t.List[str]):
+		if len(self.keys) == len(new_keys):
+			sqlexecute('CREATE TABLE "%s"."%s" (%s);' % (self.schema, self.staging, ', '.join(map(lambda key: '"%s"' % key, new_keys))))
+		else:
+			for key in new_keys:
+				sqlexecute('ALTER TABLE "%s"."%s" ADD COLUMN "%s";' % (self.schema, self.staging, key))
+
+	def flush(self):
+		""" writes the buffered rows into the staging table.
+		All rows are inserted with all known columns (missing values become NULL) such that they keep the order of the file
+		"""
+		if not self.batch:
+			return
+		columns = list(self.keys)
+		sqlexecutemany('INSERT INTO "%s"."%s" (%s) VALUES (%s);' % (self.schema, self.staging
+			, ', '.join(map(lambda key : '"' + key + '"' , columns))
+			, ', '.join('?' * len(columns))), map(lambda attrs: tuple(map(attrs.get, columns)), self.batch))
+		self.batch = []
+
+	def finish(self) -> int:
+		""" creates the typed table, moves the staged rows into it and commits. Returns the number of imported rows """
+		if len(self.keys) == 0:
+			if self.owns_transaction:
+				engine().conn.rollback()
+			return 0
+		self.flush()
+		move_staged_rows(self.tablename, self.keys, '"%s"."%s"' % (self.schema, self.staging))
+		sqlexecute('DROP TABLE "%s"."%s";' % (self.schema, self.staging))
+		if self.owns_transaction:
+			engine().conn.commit()
+		return self.rows
+
+
+def move_staged_rows(tablename: str, keys: t.Mapping[str, sqltype], staging: str):
+	""" creates the table `tablename` with the columns `keys` (or extends it by the new columns) and copies the rows of the table `staging` into it """
+	columns = ', '.join(map(lambda key: '"%s"' % key, keys))
+	if table_exists(tablename):
+		""" keys that did not occur in previously imported rows become new columns """
+		existing_columns = table_columns(tablename)
+		for key in keys:
+			if not key in existing_columns:
+				sqlexecute('ALTER TABLE "%s" ADD COLUMN "%s" %s;' % (tablename, key, str(keys[key])))
+	else:
+		sqlexecute('CREATE TABLE "%s" (%s);' % (tablename, ', '.join(map(lambda key: '"%s" %s' % (key, str(keys[key])), keys))))
+	sqlexecute('INSERT INTO "%s" (%s) SELECT %s FROM %s;' % (tablename, columns, columns, staging))
+
+
+""" the modules decompressing log files, by file extension and by the magic bytes at the beginning of a file """
+COMPRESSION_EXTENSIONS : t.Mapping[str, t.Any] = { '.gz' : gzip, '.xz' : lzma, '.bz2' : bz2 }
+COMPRESSION_MAGIC : t.List[t.Tuple[bytes, t.Any]] = [ (b'\x1f\x8b', gzip), (b'\xfd7zXZ\x00', lzma), (b'BZh', bz2) ]
+
+def compression_of(tablefilename: str) -> t.Any:
+	""" returns the module decompressing a log file, or None if the file is not compressed """
+	extension = os.path.splitext(tablefilename)[1].lower()
+	if extension in COMPRESSION_EXTENSIONS:
+		return COMPRESSION_EXTENSIONS[extension]
+	with open(tablefilename, 'rb') as f:
+		head = f.read(6)
+	for magic, module in COMPRESSION_MAGIC:
+		if head.startswith(magic) and (module != bz2 or head[3:4].isdigit()):
+			return module
+	return None
+
+def open_log(tablefilename: str, offset: int = 0) -> t.BinaryIO:
+	""" opens a log file for reading bytes starting at `offset`. A compressed file is decompressed while reading, and can only be read from its beginning """
+	module = compression_of(tablefilename)
+	if module == None:
+		tablefile = open(tablefilename, 'rb')
+		tablefile.seek(offset)
+		return tablefile
+	assert offset == 0, 'the compressed file %s can only be imported as a whole' % tablefilename
+	return module.open(tablefilename, 'rb')
+
+def end_offset(tablefilename: str, offset: int) -> int:
+	""" the byte offset up to which a log file has been read: the offset in the decompressed bytes cannot be resumed, so a compressed file counts as read completely """
+	if compression_of(tablefilename) != None:
+		return os.path.getsize(tablefilename)
+	return offset
+
+def read_resultfile(loader: TableLoader, tablefilename: str, offset: int = 0) -> t.Tuple[int, int]:
+	""" reads the RESULT lines of a log file starting at byte `offset` in a single pass into `loader`.
+	Returns the byte offset and the number of lines read.
+	"""
+	start = offset
+	lines = 0
+	""" the last line may still be written; if the reached offset is kept, the next run imports it once it is complete.
+	A file without any complete RESULT line is imported as a whole, since its table would be empty otherwise
+	"""
+	defer_unterminated = engine().persistent and compression_of(tablefilename) == None
+	with open_log(tablefilename, offset) as tablefile:
+		for rawLine in tablefile:
+			if defer_unterminated and not rawLine.endswith(b'\n') and (loader.rows > 0 or start > 0):
+				break
+			offset += len(rawLine)
+			lines += 1
+			tableLine = rawLine.decode('utf-8')
+			if tableLine.startswith('RESULT '):
+				loader.add(*tokenize_resultline(tableLine))
+	if loader.rows == 0 and start == 0:
+		die('no RESULT rows in the file %s' % tablefilename)
+	return end_offset(tablefilename, offset), lines
+
+def create_table(tablename: str, tablefilename: str, offset: int = 0) -> t.Tuple[int, int]:
+	""" reads the RESULT lines of a log file starting at byte `offset` into a table. Returns the byte offset and the number of lines read """
+	loader = TableLoader(tablename)
+	result = read_resultfile(loader, tablefilename, offset)
+	loader.finish()
+	return result
+
+
+""" number of characters read at once when parsing a JSON array incrementally """
+JSON_CHUNK_SIZE = 1 << 20
+""" the decoder reports a value cut off by the end of the buffer at most this many characters before the end, as for `fals` or a `\\uXXXX` escape """
+JSON_TRUNCATION_MARGIN = 5
+
+def json_row(record: t.Any, tablefilename: str) -> t.Dict[str, t.Any]:
+	""" converts a JSON object into a row whose values can be stored by sqlite """
+	if not isinstance(record, dict):
+		die('expected a JSON object, but got %s in the json file %s' % (str(record), tablefilename))
+	row = dict()
+	for key in record:
+		value = record[key]
+		if isinstance(value, (dict, list)):
+			value = json.dumps(value)
+		row[str(key)] = value
+	return row
+
+def json_truncated(error: json.JSONDecodeError, buffer: str) -> bool:
+	""" checks whether the decoder failed only because the entry continues beyond the end of `buffer` """
+	return error.msg.startswith('Unterminated string') or len(buffer) - error.pos <= JSON_TRUNCATION_MARGIN
+
+def json_array_records(jsonfile: t.TextIO, tablefilename: str) -> t.Iterator[t.Any]:
+	""" parses the entries of a top-level JSON array chunk by chunk """
+	decoder = json.JSONDecoder()
+	buffer = jsonfile.read(JSON_CHUNK_SIZE)
+	pos = buffer.find('[') + 1
+	assert pos > 0, 'no JSON array in file %s' % tablefilename
+	""" number of characters dropped from the front of the buffer, for reporting the position of an error """
+	consumed = 0
+	while True:
+		while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ','):
+			pos += 1
+		if pos < len(buffer) and buffer[pos] == ']':
+			return
+		if pos < len(buffer):
+			try:
+				record, end = decoder.raw_decode(buffer, pos)
+			except json.JSONDecodeError as error:
+				if not json_truncated(error, buffer):
+					die('invalid JSON in file %s at character %d: %s' % (tablefilename, consumed + error.pos, error.msg))
 			else:
-				keys[key] = merge_sqltypes(make_sqltype(entry[key]), keys[key])
-
-	columns=[]
-	for key in keys:
-		columns.append('"%s" %s' % (key, str(keys[key])))
-	if len(columns) == 0:
+				pos = end
+				yield record
+				continue
+		""" the current entry spans beyond the buffer """
+		chunk = jsonfile.read(JSON_CHUNK_SIZE)
+		if not chunk:
+			die('unterminated JSON array in file %s' % tablefilename)
+		consumed += pos
+		buffer = buffer[pos:] + chunk
+		pos = 0
+
+def read_jsonfile(loader: TableLoader, tablefilename: str, offset: int = 0) -> t.Tuple[int, int]:
+	""" reads the objects of a JSON array or of a JSON Lines file into `loader`.
+	Both formats are parsed incrementally; a JSON Lines file can be read starting at byte `offset`.
+	Returns the byte offset and the number of read lines (JSON Lines) or objects (JSON array).
+	"""
+	start = offset
+	lines = 0
+	with open_log(tablefilename) as tablefile:
+		is_array = tablefile.read(JSON_CHUNK_SIZE).lstrip().startswith(b'[')
+	if is_array:
+		assert offset == 0, 'JSON arrays can only be imported as a whole: %s' % tablefilename
+		with io.TextIOWrapper(open_log(tablefilename), encoding='utf-8') as tablefile:
+			for record in json_array_records(tablefile, tablefilename):
+				loader.add(json_row(record, tablefilename))
+				lines += 1
+		offset = os.path.getsize(tablefilename)
+	else:
+		with open_log(tablefilename, offset) as tablefile:
+			for rawLine in tablefile:
+				jsonLine = rawLine.decode('utf-8').strip()
+				if jsonLine:
+					try:
+						record = json.loads(jsonLine)
+					except ValueError:
+						if not rawLine.endswith(b'\n'):
+							""" the last line is still being written """
+							break
+						die('invalid JSON line %d in the json file %s: %s' % (lines+1, tablefilename, jsonLine))
+					else:
+						loader.add(json_row(record, tablefilename))
+				offset += len(rawLine)
+				lines += 1
+	if loader.rows == 0 and start == 0:
 		die('no data in the json file %s' % tablefilename)
-	sqlexecute('CREATE TABLE IF NOT EXISTS "%s" (%s);' % (tablename, ', '.join(columns)))
+	return end_offset(tablefilename, offset), lines
+
+def create_json_table(tablename: str, tablefilename: str, offset: int = 0) -> t.Tuple[int, int]:
+	""" reads the objects of a JSON array or of a JSON Lines file into a table. Returns the byte offset and the number of read lines or objects """
+	loader = TableLoader(tablename)
+	result = read_jsonfile(loader, tablefilename, offset)
+	loader.finish()
+	return result
+
+
+def read_csvfile(loader: TableLoader, tablefilename: str, offset: int = 0, delimiter: str = ',') -> t.Tuple[int, int]:
+	""" reads the records of a CSV file, whose first record names the columns, starting at byte `offset` into `loader`.
+	Empty fields become NULL. Returns the byte offset and the number of read lines.
+	"""
+	start = offset
+	lines = 0
+	with open_log(tablefilename) as headerfile:
+		header_line = headerfile.readline()
+	header_fields = next(csv.reader([header_line.decode('utf-8')], delimiter=delimiter), None)
+	if not header_fields:
+		die('no header in the CSV file %s' % tablefilename)
+	header = list(map(lambda column: column.strip(), header_fields))
+	with open_log(tablefilename, offset) as tablefile:
+		if offset == 0:
+			offset = len(tablefile.readline())
+			lines += 1
+		position = offset
+		def decoded_lines() -> t.Iterator[str]:
+			nonlocal position, lines
+			for rawLine in tablefile:
+				position += len(rawLine)
+				lines += 1
+				yield rawLine.decode('utf-8')
+		""" a quoted field can span several lines, so the offset is advanced only after a complete record """
+		for record in csv.reader(decoded_lines(), delimiter=delimiter, skipinitialspace=True):
+			offset = position
+			if len(record) == 0:
+				continue
+			if len(record) > len(header):
+				die('line %d of the CSV file %s has more fields than its header' % (lines, tablefilename))
+			row = dict(filter(lambda field: field[1] != '', zip(header, record)))
+			if row:
+				loader.add(row)
+	if loader.rows == 0 and start == 0:
+		die('no data in the CSV file %s' % tablefilename)
+	return end_offset(tablefilename, offset), lines
+
+def create_csv_table(tablename: str, tablefilename: str, offset: int = 0, delimiter: str = ',') -> t.Tuple[int, int]:
+	""" reads the records of a CSV file into a table. Returns the byte offset and the number of read lines """
+	loader = TableLoader(tablename)
+	result = read_csvfile(loader, tablefilename, offset, delimiter)
+	loader.finish()
+	return result
+
+
+""" maps the import keywords to the functions reading their files """
+IMPORT_READERS : t.Mapping[str, t.Callable[..., t.Tuple[int, int]]] = {
+		"IMPORT-DATA"      : read_resultfile,
+		"IMPORT-JSON-DATA" : read_jsonfile,
+		"IMPORT-CSV-DATA"  : read_csvfile,
+		}
 
-	for entry in json_data:
-		sqlexecute('INSERT INTO "%s" (%s) VALUES (%s);' % (tablename
-			, ', '.join(map(lambda key : '"' + str(key) + '"' , entry.keys()))
-			, ', '.join(map(lambda value : '\'' + str(value) + '\'', entry.values()))))
-	conn.commit()
 
+Importer = t.Callable[[str, str, int], t.Tuple[int, int]]
 
-def create_table(tablename: str, tablefilename: str):
-	""" read the types of the used keys """
-	keys = {}
-	with open(tablefilename,'r') as tablefile:
-		for tableLine in tablefile.readlines():
-			if tableLine.startswith('RESULT '):
-				attrs = split_resultline(tableLine)
-				for key in attrs:
-					if not key in keys:
-						keys[key] = make_sqltype(attrs[key])
-					else:
-						keys[key] = merge_sqltypes(make_sqltype(attrs[key]), keys[key])
-	columns=[]
-	for key in keys:
-		columns.append('"%s" %s' % (key, str(keys[key])))
-	if len(columns) == 0:
-		die('no RESULT rows in the file %s' % tablefilename)
+""" maps the import keywords to the functions importing their files into a table """
+IMPORTERS : t.Mapping[str, Importer] = {
+		"IMPORT-DATA"      : create_table,
+		"IMPORT-JSON-DATA" : create_json_table,
+		"IMPORT-CSV-DATA"  : create_csv_table,
+		}
 
-	sqlexecute('CREATE TABLE IF NOT EXISTS "%s" (%s);' % (tablename, ', '.join(columns)))
+""" matches an import directive (without the comment prefix) """
+IMPORT_PATTERN = re.compile(r'(IMPORT-DATA|IMPORT-JSON-DATA|IMPORT-CSV-DATA) ([^ ]+) (.+)')
+
+""" table storing for each imported log file its fingerprint and up to which byte it has been imported """
+IMPORT_CACHE_TABLE = 'sqlplot_imports'
+""" table storing the rowid ranges of the rows imported from a log file """
+IMPORT_RANGES_TABLE = 'sqlplot_import_ranges'
+""" number of bytes in front of the imported byte offset whose hash is used to check that a log file has only been appended to """
+TAIL_HASH_WINDOW = 1 << 16
+
+def file_hash(filename: str, begin: int = 0, end: t.Optional[int] = None) -> str:
+	""" computes a hash of the content of a file, or of its bytes in the range [begin, end) """
+	digest = hashlib.sha1()
+	with open(filename, 'rb') as f:
+		f.seek(begin)
+		remaining = end - begin if end != None else -1
+		while remaining != 0:
+			chunk = f.read(1 << 20 if remaining < 0 else min(1 << 20, remaining))
+			if not chunk:
+				break
+			digest.update(chunk)
+			remaining -= len(chunk)
+	return digest.hexdigest()
+
+def tail_hash(filename: str, offset: int) -> str:
+	return file_hash(filename, max(0, offset - TAIL_HASH_WINDOW), offset)
+
+def ends_with_newline(filename: str, offset: int) -> bool:
+	""" checks whether the byte in front of `offset` is a newline """
+	if offset == 0:
+		return True
+	with open(filename, 'rb') as f:
+		f.seek(offset - 1)
+		return f.read(1) == b'\n'
+
+def create_import_cache():
+	sqlexecute('CREATE TABLE IF NOT EXISTS "%s" (tablename TEXT, path TEXT, size INTEGER, mtime REAL, hash TEXT, byte_offset INTEGER, lines INTEGER, tail_hash TEXT, PRIMARY KEY (tablename, path));' % IMPORT_CACHE_TABLE)
+	sqlexecute('CREATE TABLE IF NOT EXISTS "%s" (tablename TEXT, path TEXT, first_rowid INTEGER, last_rowid INTEGER);' % IMPORT_RANGES_TABLE)
+	if not 'tail_hash' in table_columns(IMPORT_CACHE_TABLE):
+		""" the cache has been written by an older version storing only a single rowid range per file -> import everything anew """
+		logging.warning('discarding the import cache of an older version of sqlplot')
+		sqlexecute('SELECT DISTINCT tablename FROM "%s";' % IMPORT_CACHE_TABLE)
+		for row in engine().cursor.fetchall():
+			sqlexecute('DROP TABLE IF EXISTS "%s";' % row['tablename'])
+		sqlexecute('DROP TABLE "%s";' % IMPORT_CACHE_TABLE)
+		sqlexecute('DELETE FROM "%s";' % IMPORT_RANGES_TABLE)
+		create_import_cache()
+
+class ImportPlan:
+	""" describes which part of a log file has to be imported, as determined by plan_import """
+	tablename : str
+	tablefilename : str
+	path : str
+	stat : os.stat_result
+	cached : t.Optional[sqlite3.Row]
+	content_hash : t.Optional[str]
+	offset : int
+	lines : int
+
+	def __init__(self, tablename: str, tablefilename: str, path: str, stat: os.stat_result, cached: t.Optional[sqlite3.Row], content_hash: t.Optional[str], offset: int, lines: int):
+		self.tablename = tablename
+		self.tablefilename = tablefilename
+		self.path = path
+		self.stat = stat
+		self.cached = cached
+		self.content_hash = content_hash
+		self.offset = offset
+		self.lines = lines
+
+def plan_import(tablename: str, tablefilename: str, incremental: bool = False) -> t.Optional[ImportPlan]:
+	""" checks whether the database already contains `tablefilename` unchanged in `tablename`, in which case None is returned.
+	The size and the mtime of the file are compared first; only if they differ, we compare the content hash.
+	If the file has only been appended to and `incremental` is set, the plan starts at the byte offset reached by the previous import.
+	"""
+	create_import_cache()
+	path = os.path.realpath(tablefilename)
+	stat = os.stat(tablefilename)
+	if not table_exists(tablename):
+		sqlexecute('DELETE FROM "%s" WHERE tablename = ?;' % IMPORT_CACHE_TABLE, (tablename,))
+		sqlexecute('DELETE FROM "%s" WHERE tablename = ?;' % IMPORT_RANGES_TABLE, (tablename,))
+
+	sqlexecute('SELECT size, mtime, hash, byte_offset, lines, tail_hash FROM "%s" WHERE tablename = ? AND path = ?;' % IMPORT_CACHE_TABLE, (tablename, path))
+	cached = engine().cursor.fetchone()
+	content_hash = None
+	offset = 0
+	lines = 0
+	if cached != None:
+		if cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+			logging.info('skipping import of unchanged file %s into table %s' % (tablefilename, tablename))
+			return None
+		if cached['size'] == stat.st_size and cached['hash'] != None:
+			content_hash = file_hash(tablefilename)
+			if cached['hash'] == content_hash:
+				logging.info('skipping import of touched but unchanged file %s into table %s' % (tablefilename, tablename))
+				sqlexecute('UPDATE "%s" SET mtime = ? WHERE tablename = ? AND path = ?;' % IMPORT_CACHE_TABLE, (stat.st_mtime, tablename, path))
+				engine().conn.commit()
+				return None
+		elif (incremental and cached['size'] < stat.st_size and compression_of(tablefilename) == None
+				and ends_with_newline(tablefilename, cached['byte_offset'])
+				and cached['tail_hash'] == tail_hash(tablefilename, cached['byte_offset'])):
+			offset = cached['byte_offset']
+			lines = cached['lines']
+	return ImportPlan(tablename, tablefilename, path, stat, cached, content_hash, offset, lines)
+
+def run_import(plan: ImportPlan, importer: Importer, attach: t.Optional[str] = None):
+	""" imports a file according to `plan` with `importer` in a single transaction and records it in the import cache.
+	If the content changed, the rows of the previous import are removed first.
+	The database file `attach` is attached as `staged` for the importer.
+	"""
+	tablename = plan.tablename
+	tablefilename = plan.tablefilename
+	path = plan.path
+	if engine().conn.in_transaction:
+		engine().conn.commit()
+	if attach != None:
+		sqlexecute('ATTACH DATABASE ? AS staged;', (attach,))
+	sqlexecute('BEGIN;')
+	if plan.offset > 0:
+		logging.info('importing the lines appended to file %s after line %d into table %s' % (tablefilename, plan.lines, tablename))
+	else:
+		logging.info('importing file %s into table %s' % (tablefilename, tablename))
+		if plan.cached != None:
+			sqlexecute('SELECT count(*) FROM "%s" WHERE tablename = ?;' % IMPORT_CACHE_TABLE, (tablename,))
+			if engine().cursor.fetchone()[0] == 1:
+				""" the table stems solely from this file -> rebuild it from scratch such that the column types are inferred anew """
+				sqlexecute('DROP TABLE "%s";' % tablename)
+			else:
+				sqlexecute('SELECT first_rowid, last_rowid FROM "%s" WHERE tablename = ? AND path = ?;' % IMPORT_RANGES_TABLE, (tablename, path))
+				for rowid_range in engine().cursor.fetchall():
+					sqlexecute('DELETE FROM "%s" WHERE rowid BETWEEN ? AND ?;' % tablename, (rowid_range['first_rowid'], rowid_range['last_rowid']))
+			sqlexecute('DELETE FROM "%s" WHERE tablename = ? AND path = ?;' % IMPORT_RANGES_TABLE, (tablename, path))
+	first_rowid = max_rowid(tablename) + 1
+	new_offset, new_lines = importer(tablename, tablefilename, plan.offset)
+	last_rowid = max_rowid(tablename)
+	profile('rows_read', new_lines)
+	profile('rows_inserted', last_rowid - first_rowid + 1)
+	if first_rowid <= last_rowid:
+		sqlexecute('INSERT INTO "%s" (tablename, path, first_rowid, last_rowid) VALUES (?, ?, ?, ?);' % IMPORT_RANGES_TABLE, (tablename, path, first_rowid, last_rowid))
+	content_hash = plan.content_hash
+	if plan.offset == 0 and content_hash == None and engine().persistent:
+		""" hashing reads the file a second time, which only pays off if a later run can skip a touched but unchanged file """
+		content_hash = file_hash(tablefilename)
+	""" after an incremental import, we do not know the hash of the complete file without reading it in full """
+	sqlexecute('INSERT OR REPLACE INTO "%s" (tablename, path, size, mtime, hash, byte_offset, lines, tail_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?);' % IMPORT_CACHE_TABLE,
+		(tablename, path, plan.stat.st_size, plan.stat.st_mtime, content_hash if plan.offset == 0 else None, new_offset, plan.lines + new_lines, tail_hash(tablefilename, new_offset)))
+	engine().conn.commit()
+	if attach != None:
+		sqlexecute('DETACH DATABASE staged;')
+
+
+class ImportJob:
+	""" an IMPORT-DATA, IMPORT-JSON-DATA or IMPORT-CSV-DATA directive. `options` are the keyword arguments of its reader """
+	keyword : str
+	tablename : str
+	tablefilename : str
+	options : t.Dict[str, str]
+
+	def __init__(self, keyword: str, tablename: str, tablefilename: str, options: t.Optional[t.Dict[str, str]] = None):
+		self.keyword = keyword
+		self.tablename = tablename
+		self.tablefilename = tablefilename
+		self.options = options if options != None else dict()
 
-	# read the values
-	with open(tablefilename, 'r') as tablefile:
-		for tableLine in tablefile.readlines():
-			if tableLine.startswith('RESULT '):
-				attrs = split_resultline(tableLine)
-				sqlexecute('INSERT INTO "%s" (%s) VALUES (%s);' % (tablename
-					, ', '.join(map(lambda key : '"' + key + '"' , attrs.keys()))
-					, ', '.join(map(lambda value : '\'' + value + '\'', attrs.values()))))
-		conn.commit()
+	@staticmethod
+	def parse(line: str) -> t.Optional["ImportJob"]:
+		""" parses an import directive (without the comment prefix); returns None if `line` is not an import directive """
+		match = IMPORT_PATTERN.match(line)
+		if not match:
+			return None
+		keyword, tablename, tablefilename = match.group(1), match.group(2), match.group(3).strip()
+		if keyword != 'IMPORT-CSV-DATA':
+			return ImportJob(keyword, tablename, tablefilename)
+		""" IMPORT-CSV-DATA table file [delimiter], where the delimiter may be escaped like `\\t` """
+		match = re.match(r'(\S+)(?:\s+(\S+))?$', tablefilename)
+		assert match, 'invalid IMPORT-CSV-DATA directive: %s' % line
+		if match.group(2) == None:
+			return ImportJob(keyword, tablename, match.group(1))
+		delimiter = codecs.decode(match.group(2), 'unicode_escape')
+		assert len(delimiter) == 1, 'the CSV delimiter must be a single character: %s' % line
+		return ImportJob(keyword, tablename, match.group(1), { 'delimiter' : delimiter })
+
+	def importer(self) -> Importer:
+		return functools.partial(IMPORTERS[self.keyword], **self.options)
+
+def stage_import(keyword: str, tablename: str, tablefilename: str, offset: int, options: t.Dict[str, str], persistent: bool) -> t.Tuple[str, str, t.Dict[str, sqltype], int, int, float]:
+	""" runs in a worker process: parses a file into a staging table of a new temporary database.
+	`persistent` tells whether the database receiving the staged rows is kept, see Engine.persistent.
+	Returns the database file, the name of the staging table, the column types, the byte offset, the number of read lines and the time spent
+	"""
+	started = time.perf_counter()
+	fd, staging_database = tempfile.mkstemp(prefix='sqlplot-', suffix='.db')
+	os.close(fd)
+	staging = Engine(staging_database, ColorCache())
+	staging.persistent = persistent
+	try:
+		with staging.activate():
+			""" the staging database is thrown away on failure, so there is no need for a journal """
+			sqlexecute('PRAGMA journal_mode = OFF;')
+			sqlexecute('PRAGMA synchronous = OFF;')
+			loader = TableLoader(tablename, 'main')
+			new_offset, lines = IMPORT_READERS[keyword](loader, tablefilename, offset, **options)
+			loader.flush()
+			staging.conn.commit()
+	except BaseException:
+		staging.close()
+		os.remove(staging_database)
+		raise
+	staging.close()
+	return staging_database, loader.staging, loader.keys, new_offset, lines, time.perf_counter() - started
+
+def import_all(jobs: t.List[ImportJob], processes: int) -> t.Set[str]:
+	""" imports the files of all IMPORT directives.
+	The files that need to be imported are parsed by a pool of `processes` worker processes, each into its own staging database.
+	The staged rows are then copied into the database one file after another in the order of `jobs`.
+	Returns the names of the tables that received new rows.
+	"""
+	plans : t.List[t.Tuple[ImportJob, ImportPlan]] = []
+	planned : t.Set[t.Tuple[str, str]] = set()
+	for job in jobs:
+		key = (job.tablename, os.path.realpath(job.tablefilename))
+		if key in planned:
+			continue
+		planned.add(key)
+		plan = plan_import(job.tablename, job.tablefilename, incremental=True)
+		if plan != None:
+			plans.append((job, plan))
+
+	imported_tables = set(map(lambda entry: entry[1].tablename, plans))
+	profiler = engine().profiler
+	if processes <= 1 or len(plans) <= 1:
+		for job, plan in plans:
+			if profiler != None:
+				profiler.start(job.keyword, '%s %s' % (job.tablename, job.tablefilename))
+			run_import(plan, job.importer())
+			if profiler != None:
+				profiler.finish()
+		return imported_tables
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=min(processes, len(plans))) as pool:
+		futures = list(map(lambda entry: pool.submit(stage_import, entry[0].keyword, entry[1].tablename, entry[1].tablefilename, entry[1].offset, entry[0].options, engine().persistent), plans))
+		try:
+			for (job, plan), future in zip(plans, futures):
+				staging_database, staging, keys, new_offset, lines, parse_time = future.result()
+				if profiler != None:
+					profiler.start(job.keyword, '%s %s' % (job.tablename, job.tablefilename))
+					profile('parse_time', parse_time)
+					profile('wall_time', parse_time)
+				def merge_staged(tablename: str, tablefilename: str, offset: int) -> t.Tuple[int, int]:
+					if len(keys) > 0:
+						move_staged_rows(tablename, keys, 'staged."%s"' % staging)
+					return new_offset, lines
+				try:
+					run_import(plan, merge_staged, attach=staging_database)
+				finally:
+					os.remove(staging_database)
+				if profiler != None:
+					profiler.finish()
+		finally:
+			""" if an import failed, the staging databases of the files not yet merged are removed as well """
+			for future in futures:
+				future.cancel()
+			concurrent.futures.wait(futures)
+			for future in futures:
+				if not future.cancelled() and future.exception() == None:
+					staging_database = future.result()[0]
+					if os.path.exists(staging_database):
+						os.remove(staging_database)
+	return imported_tables
+
+
+""" table storing the results of the queries of the plot and table directives """
+RESULT_CACHE_TABLE = 'sqlplot_results'
+
+def read_tables(sqlcommand: str) -> t.Set[str]:
+	""" returns the names of the tables read by a query by letting sqlite prepare it with an authorizer.
+	An invalid query raises sqlite3.Error without reporting it; it is reported once it is executed
+	"""
+	tables : t.Set[str] = set()
+	def authorizer(action, arg1, arg2, dbname, trigger):
+		if action == sqlite3.SQLITE_READ and arg1 != None:
+			tables.add(arg1)
+		return sqlite3.SQLITE_OK
+	engine().conn.set_authorizer(authorizer)
+	try:
+		engine().conn.execute('EXPLAIN ' + sqlcommand)
+	finally:
+		engine().conn.set_authorizer(None)
+	return tables
+
+def table_fingerprint(tablename: str) -> t.Optional[t.List[t.Any]]:
+	""" fingerprints a table by the files imported into it. Returns None for tables not filled by IMPORT-DATA/IMPORT-JSON-DATA """
+	create_import_cache()
+	sqlexecute('SELECT path, size, mtime, byte_offset FROM "%s" WHERE tablename = ? ORDER BY path;' % IMPORT_CACHE_TABLE, (tablename,))
+	rows = engine().cursor.fetchall()
+	if len(rows) == 0:
+		return None
+	return list(map(tuple, rows))
+
+def query_plan(sqlcommand: str) -> t.List[str]:
+	sqlexecute('EXPLAIN QUERY PLAN ' + sqlcommand)
+	return list(map(lambda row: row['detail'], engine().cursor.fetchall()))
+
+def count_rows(result: t.Any) -> int:
+	""" counts the rows of a processed query result, which is either a list of rows or a dictionary mapping series to lists of rows """
+	if isinstance(result, dict):
+		return sum(map(len, result.values()))
+	return len(result)
+
+def cached_query(sqlcommand: str, config_args: t.Mapping[str,str], compute: t.Callable[[], t.Any]) -> t.Any:
+	""" returns compute(), which executes `sqlcommand` and processes its rows.
+	The result is cached in the database with a key made of the query, the CONFIG arguments and the fingerprints of the tables read by the query.
+	Queries reading tables without a fingerprint are not cached.
+	compute() can return an iterator streaming the rows, which is collected into a list only if it is stored in the cache
+	"""
+	if engine().profiler != None:
+		profile('query', sqlcommand)
+		profile('query_plan', query_plan(sqlcommand))
+	result = lookup_query_result(sqlcommand, config_args, compute)
+	if engine().profiler != None and not isinstance(result, collections.abc.Iterator):
+		profile('rows_returned', count_rows(result))
+	return result
+
+def create_result_cache():
+	sqlexecute('CREATE TABLE IF NOT EXISTS "%s" (key TEXT PRIMARY KEY, result BLOB);' % RESULT_CACHE_TABLE)
+
+def result_cache_key(sqlcommand: str, config_args: t.Mapping[str,str]) -> t.Optional[str]:
+	""" returns the key of a query in the result cache, or None if the query cannot be cached """
+	fingerprints = dict()
+	for tablename in sorted(read_tables(sqlcommand)):
+		fingerprint = table_fingerprint(tablename)
+		if fingerprint == None:
+			logging.info('not caching the query reading table %s, which is not imported: %s' % (tablename, sqlcommand))
+			return None
+		fingerprints[tablename] = fingerprint
+	return hashlib.sha1(repr((sqlcommand, sorted(config_args.items()), fingerprints)).encode('utf-8')).hexdigest()
+
+def is_cached(key: str) -> bool:
+	create_result_cache()
+	sqlexecute('SELECT 1 FROM "%s" WHERE key = ?;' % RESULT_CACHE_TABLE, (key,))
+	return engine().cursor.fetchone() != None
+
+def lookup_query_result(sqlcommand: str, config_args: t.Mapping[str,str], compute: t.Callable[[], t.Any]) -> t.Any:
+	if not engine().result_cache_enabled:
+		return compute()
+	try:
+		key = result_cache_key(sqlcommand, config_args)
+	except sqlite3.Error:
+		""" compute() reports the error of the query """
+		key = None
+	if key == None:
+		return compute()
+	create_result_cache()
+	sqlexecute('SELECT result FROM "%s" WHERE key = ?;' % RESULT_CACHE_TABLE, (key,))
+	cached = engine().cursor.fetchone()
+	if cached != None:
+		logging.info('using cached result of the query: %s' % sqlcommand)
+		profile('cached', True)
+		return pickle.loads(cached['result'])
+	result = compute()
+	if isinstance(result, collections.abc.Iterator):
+		result = list(result)
+	pending = engine().result_cache_pending
+	if pending != None:
+		pending.append((key, pickle.dumps(result)))
+		return result
+	sqlexecute('INSERT OR REPLACE INTO "%s" (key, result) VALUES (?, ?);' % RESULT_CACHE_TABLE, (key, pickle.dumps(result)))
+	engine().conn.commit()
+	return result
+
+def store_query_results(results: t.List[t.Tuple[str, bytes]]):
+	""" writes the query results collected in result_cache_pending into the result cache """
+	if len(results) == 0:
+		return
+	create_result_cache()
+	sqlexecutemany('INSERT OR REPLACE INTO "%s" (key, result) VALUES (?, ?);' % RESULT_CACHE_TABLE, results)
+	engine().conn.commit()
+
+
+def connect_readonly(databasename: str) -> sqlite3.Connection:
+	""" opens a read-only connection to the database file `databasename` with the functions of sqlplot """
+	readonly = sqlite3.connect('file:%s?mode=ro' % urllib.request.pathname2url(os.path.abspath(databasename)), uri=True, check_same_thread=False)
+	readonly.row_factory = sqlite3.Row
+	register_functions(readonly)
+	return readonly
+
+def main_database_file() -> str:
+	""" returns the file of the main database, which is empty for an in-memory database """
+	sqlexecute('PRAGMA database_list;')
+	return next(filter(lambda row: row['name'] == 'main', engine().cursor.fetchall()))['file']
+
+def table_rows(tablename: str) -> int:
+	""" estimates the number of rows of a table by its largest rowid """
+	try:
+		return max_rowid(tablename)
+	except sqlite3.Error:
+		""" a table without rowid """
+		return 0
+
+""" an in-memory database is copied for the threads of a query pool only if the queries read at least this many times the rows of the database """
+QUERY_POOL_SNAPSHOT_FACTOR = 2
+
+def snapshot_pays_off(queries: t.List[str]) -> bool:
+	""" checks whether running `queries` concurrently saves more time than copying an in-memory database for the threads costs.
+	Both are estimated by rows: a query reads all rows of the tables it uses, and the copy all rows of the database
+	"""
+	sqlexecute('SELECT name FROM sqlite_master WHERE type = \'table\' AND substr(name, 1, 7) != \'sqlite_\';')
+	tables = list(map(lambda row: row['name'], engine().cursor.fetchall()))
+	database_rows = sum(map(table_rows, tables))
+	rows_read = 0
+	for query in queries:
+		try:
+			rows_read += sum(map(table_rows, filter(lambda tablename: tablename in tables, read_tables(query))))
+		except sqlite3.Error:
+			""" the error is reported when the main loop reaches the query """
+			pass
+	return rows_read >= QUERY_POOL_SNAPSHOT_FACTOR * database_rows
+
+class QueryPool:
+	""" runs queries ahead of the main loop on a pool of threads, each with its own read-only connection to the database.
+	sqlite releases the GIL while executing a query, so independent queries run concurrently.
+	At most `threads` queries are run ahead, such that only their result sets are held in memory; the others wait in `queue` in the order of the document.
+	An in-memory database is first copied into a temporary file, which the threads read
+	"""
+	databasename : str
+	snapshot : t.Optional[str]
+	threads : int
+	""" the submitted queries that have not been handed to the threads yet """
+	queue : t.Deque[str]
+	futures : t.Dict[str, t.List[concurrent.futures.Future]]
+	""" the number of futures in `futures`, whose results have not been taken yet """
+	running : int
+
+	def __init__(self, threads: int):
+		self.snapshot = None
+		self.databasename = main_database_file()
+		if engine().conn.in_transaction:
+			engine().conn.commit()
+		if not self.databasename:
+			fd, self.snapshot = tempfile.mkstemp(prefix='sqlplot-', suffix='.db')
+			os.close(fd)
+			with contextlib.closing(sqlite3.connect(self.snapshot)) as snapshot:
+				engine().conn.backup(snapshot)
+			self.databasename = self.snapshot
+		self.local = threading.local()
+		self.connections : t.List[sqlite3.Connection] = []
+		self.lock = threading.Lock()
+		self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+		self.threads = threads
+		self.queue = collections.deque()
+		self.futures = dict()
+		self.running = 0
+
+	def execute(self, sqlcommand: str) -> t.List[sqlite3.Row]:
+		""" runs in a thread of the pool """
+		if not hasattr(self.local, 'conn'):
+			self.local.conn = connect_readonly(self.databasename)
+			with self.lock:
+				self.connections.append(self.local.conn)
+		try:
+			return self.local.conn.execute(sqlcommand + ';').fetchall()
+		except sqlite3.Error as e:
+			print("Error while executing the SQL statement: ", sqlcommand, file=sys.stderr)
+			raise e
+
+	def submit(self, sqlcommand: str):
+		self.queue.append(sqlcommand)
+		self.run_ahead()
+
+	def run_ahead(self):
+		""" hands queued queries to the threads until `threads` results are pending """
+		while self.running < self.threads and len(self.queue) > 0:
+			sqlcommand = self.queue.popleft()
+			self.futures.setdefault(sqlcommand, []).append(self.pool.submit(self.execute, sqlcommand))
+			self.running += 1
+
+	def take(self, sqlcommand: str) -> t.Optional[t.List[sqlite3.Row]]:
+		""" waits for the rows of a submitted query; returns None if the query has not been submitted or is still queued,
+		in which case the caller executes (and streams) it itself
+		"""
+		futures = self.futures.get(sqlcommand)
+		if not futures:
+			if sqlcommand in self.queue:
+				self.queue.remove(sqlcommand)
+			return None
+		future = futures.pop(0)
+		self.running -= 1
+		self.run_ahead()
+		return future.result()
+
+	def close(self):
+		self.pool.shutdown(wait=True, cancel_futures=True)
+		for readonly in self.connections:
+			readonly.close()
+		if self.snapshot != None:
+			os.remove(self.snapshot)
+
+def query_rows(sqlcommand: str) -> t.Iterable[sqlite3.Row]:
+	""" executes a query, or takes its rows from the query pool if it has been submitted there """
+	query_pool = engine().query_pool
+	if query_pool != None:
+		rows = query_pool.take(sqlcommand)
+		if rows != None:
+			return rows
+	sqlexecute(sqlcommand + ';')
+	return engine().cursor
+
+""" number of rows fetched at once when streaming the rows of a TABULAR or MATRIX query """
+FETCH_BATCH_SIZE = 1024
+
+def query_batches(sqlcommand: str) -> t.Iterator[t.List[sqlite3.Row]]:
+	""" executes a query and yields its rows in batches of FETCH_BATCH_SIZE rows, or takes its rows from the query pool if it has been submitted there """
+	query_pool = engine().query_pool
+	if query_pool != None:
+		rows = query_pool.take(sqlcommand)
+		if rows != None:
+			yield rows
+			return
+	sqlexecute(sqlcommand + ';')
+	while True:
+		batch = engine().cursor.fetchmany(FETCH_BATCH_SIZE)
+		if not batch:
+			return
+		yield batch
+
+def start_query_pool(directives: t.List["Directive"], threads: int) -> t.Optional[QueryPool]:
+	""" submits the queries of the directives of a document, whose results are not cached, to a new pool of `threads` threads """
+	queries = scan_queries(directives, engine().macros)
+	uncached : t.List[str] = []
+	for query, multiplot_columns, query_config in queries:
+		try:
+			if engine().result_cache_enabled and (lambda key: key != None and is_cached(key))(result_cache_key(query, query_config)):
+				continue
+		except sqlite3.Error:
+			""" the error is reported when the main loop reaches the query """
+			pass
+		uncached.append(query)
+	if threads <= 1 or len(uncached) <= 1:
+		return None
+	if not main_database_file() and not snapshot_pays_off(uncached):
+		logging.info('running the queries sequentially, since they read too few rows to pay off copying the in-memory database')
+		return None
+	pool = QueryPool(threads)
+	for query in uncached:
+		pool.submit(query)
+	return pool
 
 
 class ReadStatus(IntEnum):
@@ -140,54 +1010,107 @@ keyword_to_status : t.Mapping[str, ReadStatus] = {
 		"DEFINE"     : ReadStatus.MACRO
 		}
 
-def apply_macros(sqlbuffer: str) -> str:
-	match = re.search(r'\$(\w+)', sqlbuffer)
+""" matches a macro call `$macro(...)`; the second group is empty if the name is not followed by an opening parenthesis """
+MACRO_CALL_PATTERN = re.compile(r'\$(\w+)(\s*\()?')
+""" maximal nesting depth of macro calls, which is only exceeded by a macro calling itself """
+MACRO_RECURSION_LIMIT = 64
+
+def split_macro_parameters(sqlbuffer: str, start: int) -> t.Tuple[t.List[str], int]:
+	""" reads the comma-separated parameters of a macro call starting at position `start` after its opening parenthesis.
+	Commas and parentheses within parentheses or quotes do not end a parameter.
+	Returns the parameters and the position after the closing parenthesis
+	"""
+	parameters : t.List[str] = []
+	depth = 0
+	quote = None
+	begin = start
+	for position in range(start, len(sqlbuffer)):
+		char = sqlbuffer[position]
+		if quote != None:
+			if char == quote:
+				quote = None
+		elif char == "'" or char == '"':
+			quote = char
+		elif char == '(':
+			depth += 1
+		elif char == ')':
+			if depth == 0:
+				parameters.append(sqlbuffer[begin:position])
+				return parameters, position+1
+			depth -= 1
+		elif char == ',' and depth == 0:
+			parameters.append(sqlbuffer[begin:position])
+			begin = position+1
+	die('missing closing parenthesis of the macro call in the sql expression: ' + sqlbuffer)
+	return parameters, len(sqlbuffer)
+
+def expand_macros(sqlbuffer: str, macrotable: t.Mapping[str, "Macro"], depth: int, used: t.List[t.Tuple[str, "Macro"]]) -> str:
+	""" expands the macro calls of `sqlbuffer` in a single pass from left to right, and adds the called macros to `used` """
+	if sqlbuffer.find('$') == -1:
+		return sqlbuffer
+	pieces : t.List[str] = []
+	position = 0
+	match = MACRO_CALL_PATTERN.search(sqlbuffer)
 	while match:
 		macroname = match.group(1)
-		assert macroname in macros, 'macro not defined: "%s". used in the sql expression: %s' % (macroname, sqlbuffer)
-		sqlbuffer = macros[macroname].apply(sqlbuffer)
-		match = re.search(r'\\$(\w+)', sqlbuffer)
-	return sqlbuffer
+		assert macroname in macrotable, 'macro not defined: "%s". used in the sql expression: %s' % (macroname, sqlbuffer)
+		assert match.group(2), 'macro "%s" used without parameters in the sql expression: %s' % (macroname, sqlbuffer)
+		parameters, end = split_macro_parameters(sqlbuffer, match.end())
+		pieces.append(sqlbuffer[position:match.start()])
+		pieces.append(expand_macro(macrotable[macroname], tuple(parameters), macrotable, depth, used))
+		position = end
+		match = MACRO_CALL_PATTERN.search(sqlbuffer, position)
+	pieces.append(sqlbuffer[position:])
+	return ''.join(pieces)
+
+def expand_macro(macro: "Macro", parameters: t.Tuple[str, ...], macrotable: t.Mapping[str, "Macro"], depth: int, used: t.List[t.Tuple[str, "Macro"]]) -> str:
+	""" expands a call of `macro` with `parameters`, including the macro calls of its body and parameters.
+	The expansion is memoized in `macro`, and reused as long as the macros it called are still defined the same way in `macrotable`
+	"""
+	assert depth < MACRO_RECURSION_LIMIT, 'macro "%s" nested deeper than %d levels, does it call itself?' % (macro.name, MACRO_RECURSION_LIMIT)
+	used.append((macro.name, macro))
+	if parameters in macro.expansions:
+		expansion, called = macro.expansions[parameters]
+		if all(map(lambda entry: macrotable.get(entry[0]) is entry[1], called)):
+			used.extend(called)
+			return expansion
+	called : t.List[t.Tuple[str, Macro]] = []
+	expansion = expand_macros(macro.substitute(parameters), macrotable, depth+1, called)
+	macro.expansions[parameters] = (expansion, called)
+	used.extend(called)
+	return expansion
+
+def apply_macros(sqlbuffer: str, macrotable: t.Optional[t.Mapping[str, "Macro"]] = None) -> str:
+	""" expands the macros of `macrotable`, which are by default the macros defined so far """
+	if macrotable == None:
+		macrotable = engine().macros
+	return expand_macros(sqlbuffer, macrotable, 0, [])
+
+
+def multiplot_query(sqlbuffer : str, multiplot_columns : t.List[str]) -> str:
+	""" replaces the keyword MULTIPLOT of a macro-expanded MULTIPLOT statement by its columns """
+	""" if a column is is `a`.`b`, then we have to alias it to `a.b` """
+	group_query = re.sub('MULTIPLOT', ','.join(map(lambda col: ".".join(map(lambda el: '"%s"' % el, col.split('.'))) + ' AS "%s"' % col, multiplot_columns)), sqlbuffer, 1)
 
+	return re.sub('MULTIPLOT', ','.join(map(lambda col: '"%s"' % col, multiplot_columns)), group_query)
 
 def multiplot(sqlbuffer : str, multiplot_columns : t.List[str]) -> t.Mapping[str, t.List[t.Tuple[str,str]]]:
 	""" reads a MULTIPLOT statement and returns a dictionary mapping a MULTIPLOT instance to a list of coordinates """
 	sqlbuffer = apply_macros(sqlbuffer)
 	logging.info("macros-expanded SQL : " + sqlbuffer);
 
-	""" if a column is is `a`.`b`, then we have to alias it to `a.b` """
-	group_query = re.sub('MULTIPLOT', ','.join(map(lambda col: ".".join(map(lambda el: '"%s"' % el, col.split('.'))) + ' AS "%s"' % col, multiplot_columns)), sqlbuffer, 1)
+	group_query = multiplot_query(sqlbuffer, multiplot_columns)
 
-	group_query = re.sub('MULTIPLOT', ','.join(map(lambda col: '"%s"' % col, multiplot_columns)), group_query)
-
-	""" query for all possible values the variable MULTIPLOT can have """
-	sqlexecute(group_query + ';')
-	multiplot_value_tuples=set()
-	# for row in cursor.fetchall():
-	# 	multiplot_value_tuples.add(tuple(row[x] for x in multiplot_columns))
-
-	multiplot_value_tuples = list(map(lambda row: tuple(row[x] for x in multiplot_columns), cursor.fetchall()))
-	coordinates=dict()
-	for multiplot_values in multiplot_value_tuples: 
-		#! this is a heuristic: we assume that if there is a where clause than this is for the outmost select command (and not for a subquery)
-		if re.search(' where ', group_query, re.IGNORECASE):
-			query = re.sub('(.*) where ', '\\1 WHERE %s AND ' % 
-					' AND '.join(map(lambda x: '"%s" = \'%s\'' % (x[0],x[1]), zip(multiplot_columns, multiplot_values)))
-					, group_query, flags=re.IGNORECASE)
-		else:
-			query = re.sub('(.*) group by ', '\\1 WHERE %s GROUP BY ' % 
-					' AND '.join(map(lambda x: '"%s" = \'%s\'' % (x[0],x[1]), zip(multiplot_columns, multiplot_values)))
-					, group_query, flags=re.IGNORECASE)
-		sqlexecute(query + ';')
-		rows = cursor.fetchall()
-		#if(len(rows) > 0):
-			# try:
-			# 	list(map(lambda row: (float(row['x']), float(row['y'])), rows))
-			# except ValueError:
-			# 	die('Values of the MULTIPLOT tuple %s are not floats/not defined. SQL-Statement: %s ' % (str(multiplot_values),sqlbuffer) )
-            #
-		coordinates[multiplot_values] = list(map(lambda row: (row['x'], row['y']), rows))
-	return coordinates
+	""" a single query yields the coordinates of all MULTIPLOT instances; we split the rows into the series while streaming through the cursor """
+	def compute() -> t.Dict[t.Tuple[t.Any, ...], t.List[t.Tuple[t.Any, t.Any]]]:
+		coordinates : t.Dict[t.Tuple[t.Any, ...], t.List[t.Tuple[t.Any, t.Any]]] = dict()
+		for row in query_rows(group_query):
+			multiplot_values = tuple(row[x] for x in multiplot_columns)
+			if not multiplot_values in coordinates:
+				coordinates[multiplot_values] = []
+			coordinates[multiplot_values].append((row['x'], row['y']))
+		return coordinates
+	return cached_query(group_query, engine().config_args, compute)
 
 
 class Filetype(IntEnum):
@@ -196,6 +1119,7 @@ class Filetype(IntEnum):
 	JS = auto()
 	CSV = auto()
 	GNUPLOT = auto()
+	NPZ = auto()
 	UNKNOWN = auto()
 
 	def comment(self):
@@ -214,44 +1138,309 @@ class Filetype(IntEnum):
 			return Filetype.CSV
 		if(text == 'tex'):
 			return Filetype.TEX
-		if(text == 'csv'):
+		if(text == 'json' or text == 'js'):
 			return Filetype.JS
 		if(text == 'py'):
 			return Filetype.PYTHON
 		if(text == 'plt' or text == 'gnuplot'):
 			return Filetype.GNUPLOT
+		if(text == 'npz'):
+			return Filetype.NPZ
 		return Filetype.UNKNOWN
 
 
 
-## MAIN
-color_entries = dict()
-try:
-	from ast import literal_eval
-	with open('pgf_color_entries.txt','r') as txtfile:
-		for line in txtfile.readlines():
-			if line.startswith('#'):
+def scan_queries(directives: t.Iterable["Directive"], macros: t.Optional[t.Mapping[str, "Macro"]] = None) -> t.List[t.Tuple[str, t.List[str], t.Dict[str, str]]]:
+	""" collects the macro-expanded queries of the MULTIPLOT, SINGLEPLOT, TABULAR and MATRIX directives of a document without executing them.
+	The directives can use the `macros` defined before them, while a document starts without macros.
+	Returns for each query the SQL executed by process_document, the MULTIPLOT columns and the CONFIG arguments.
+	"""
+	queries : t.List[t.Tuple[str, t.List[str], t.Dict[str, str]]] = []
+	scanned_macros : t.Dict[str, Macro] = dict(macros) if macros != None else dict()
+	for directive in directives:
+		if isinstance(directive, MacroDirective):
+			scanned_macros[directive.macro.name] = directive.macro
+		elif isinstance(directive, UndefDirective):
+			scanned_macros.pop(directive.name, None)
+		elif isinstance(directive, QueryDirective):
+			queries.append((directive.query(scanned_macros), directive.columns if isinstance(directive, PlotDirective) else [], directive.config))
+	return queries
+
+""" matches a column compared for equality, e.g., `"file" = 'english'` or `t.algo IN (...)` """
+EQUALITY_PATTERN = re.compile(r'(?:\w+\.)?"?(\w+)"?\s*(?:==?|\bIN\b|\bIS\b)', re.IGNORECASE)
+""" matches the expression list of a GROUP BY clause """
+GROUPBY_PATTERN = re.compile(r'\bGROUP\s+BY\s+(.*?)(?:\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|\bWINDOW\b|\)|;|$)', re.IGNORECASE | re.DOTALL)
+
+def read_columns(sqlcommand: str) -> t.Dict[str, t.Set[str]]:
+	""" returns for each table read by a query the columns it reads, by letting sqlite prepare the query with an authorizer """
+	columns : t.Dict[str, t.Set[str]] = dict()
+	def authorizer(action, arg1, arg2, dbname, trigger):
+		if action == sqlite3.SQLITE_READ and arg1 != None and arg2:
+			columns.setdefault(arg1, set()).add(arg2)
+		return sqlite3.SQLITE_OK
+	engine().conn.set_authorizer(authorizer)
+	try:
+		engine().conn.execute('EXPLAIN ' + sqlcommand)
+	finally:
+		engine().conn.set_authorizer(None)
+	return columns
+
+def advise_indexes(queries: t.List[t.Tuple[str, t.List[str], t.Dict[str, str]]]) -> t.Dict[str, t.List[t.Tuple[str, ...]]]:
+	""" proposes for each imported table composite indexes on the columns compared for equality by a query, followed by its grouping columns """
+	create_import_cache()
+	sqlexecute('SELECT DISTINCT tablename FROM "%s";' % IMPORT_CACHE_TABLE)
+	imported_tables = set(map(lambda row: row['tablename'], engine().cursor.fetchall()))
+	advice : t.Dict[str, t.List[t.Tuple[str, ...]]] = dict()
+	for query, multiplot_columns, _ in queries:
+		try:
+			read = read_columns(query)
+		except sqlite3.Error as e:
+			logging.info('cannot advise indexes for the query %s: %s' % (query, e))
+			continue
+		equality_columns = list(map(lambda match: match.group(1), EQUALITY_PATTERN.finditer(query)))
+		group_columns = list(multiplot_columns)
+		for match in GROUPBY_PATTERN.finditer(query):
+			group_columns += map(lambda col: col.strip().strip('"').split('.')[-1].strip('"'), match.group(1).split(','))
+		for tablename in read:
+			if not tablename in imported_tables:
 				continue
-			cols = line.split("\t")
-			assert len(cols) == 2, "Invalid Line : " + line
-			if len(cols) == 2: 
-				try:
-					color_entries[literal_eval(cols[0])] = int(cols[1]) 
-					""" we use literal_eval to deserialize a tuple as keys are tuples """
-				except ValueError:
-					print('could not parse the line `%s` in pgf_color_entries.txt' % line, file=sys.stderr)
-					sys.exit(1)
-			
-except IOError:
-	print('file pgf_color_entries.txt does not exist -> will create it.', file=sys.stderr)
-
+			index_columns : t.List[str] = []
+			for column in equality_columns + group_columns:
+				if column in read[tablename] and not column in index_columns:
+					index_columns.append(column)
+			if index_columns:
+				advice.setdefault(tablename, [])
+				if not tuple(index_columns) in advice[tablename]:
+					advice[tablename].append(tuple(index_columns))
+	for tablename in advice:
+		""" an index whose columns are a prefix of the columns of another index is superfluous """
+		advice[tablename] = list(filter(lambda index: not any(map(lambda other: len(other) > len(index) and other[:len(index)] == index, advice[tablename])), advice[tablename]))
+	return advice
+
+def create_indexes(advice: t.Mapping[str, t.List[t.Tuple[str, ...]]], imported_tables: t.Set[str]):
+	""" creates the advised indexes unless they exist already, and updates the statistics of the tables with new indexes or new rows """
+	analyze = set(imported_tables)
+	for tablename in advice:
+		for index_columns in advice[tablename]:
+			indexname = 'sqlplot_index_%s_%s' % (tablename, hashlib.sha1(repr(index_columns).encode('utf-8')).hexdigest()[:12])
+			sqlexecute('SELECT 1 FROM sqlite_master WHERE type = \'index\' AND name = ?;', (indexname,))
+			if engine().cursor.fetchone() != None:
+				continue
+			logging.info('creating index on table %s for the columns %s' % (tablename, ', '.join(index_columns)))
+			sqlexecute('CREATE INDEX "%s" ON "%s" (%s);' % (indexname, tablename, ', '.join(map(lambda col: '"%s"' % col, index_columns))))
+			analyze.add(tablename)
+	for tablename in sorted(analyze):
+		if table_exists(tablename):
+			sqlexecute('ANALYZE "%s";' % tablename)
+	engine().conn.commit()
+
+
+class Profiler:
+	""" records for each directive its wall time, further statistics set via `profile`, and the peak memory of the process """
+	records : t.List[t.Dict[str, t.Any]]
+	current : t.Optional[t.Dict[str, t.Any]]
+	started : float
+
+	def __init__(self):
+		self.records = []
+		self.current = None
+		self.started = 0
+
+	def start(self, directive: str, text: str):
+		self.current = { 'directive' : directive, 'text' : ' '.join(text.split()) }
+		self.records.append(self.current)
+		self.started = time.perf_counter()
+
+	def finish(self):
+		assert self.current != None
+		self.current['wall_time'] = self.current.get('wall_time', 0) + time.perf_counter() - self.started
+		if resource != None:
+			""" ru_maxrss is the peak resident set size of the whole process up to now (KiB on Linux) """
+			self.current['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		self.current = None
+
+	def report(self, filename: str):
+		""" writes all records to the JSON file `filename` and a summary sorted by wall time to stderr """
+		with open(filename, 'w') as reportfile:
+			json.dump(self.records, reportfile, indent=1)
+		print('%10s  %-16s %10s %10s %10s  %s' % ('time[s]', 'directive', 'rows in', 'rows out', 'bytes out', 'text'), file=sys.stderr)
+		for record in sorted(self.records, key=lambda record: -record['wall_time']):
+			print('%10.3f  %-16s %10s %10s %10s  %s' % (record['wall_time'], record['directive'] + (' (cached)' if record.get('cached') else ''),
+				record.get('rows_inserted', ''), record.get('rows_returned', ''), record.get('bytes_written', ''), record['text'][:80]), file=sys.stderr)
+
+def profile(key: str, value: t.Any):
+	""" sets a statistic of the directive that is currently profiled """
+	profiler = engine().profiler
+	if profiler != None and profiler.current != None:
+		profiler.current[key] = value
+
+
+""" the file storing the color entries between the runs """
+COLOR_ENTRIES_FILE = 'pgf_color_entries.txt'
+
+def read_color_entries(filename: str) -> t.Dict[t.Any, int]:
+	""" reads the color entries of the file `filename` written by write_color_entries """
+	color_entries : t.Dict[t.Any, int] = dict()
+	try:
+		from ast import literal_eval
+		with open(filename,'r') as txtfile:
+			for line in txtfile.readlines():
+				if line.startswith('#'):
+					continue
+				cols = line.split("\t")
+				assert len(cols) == 2, "Invalid Line : " + line
+				if len(cols) == 2: 
+					try:
+						color_entries[literal_eval(cols[0])] = int(cols[1]) 
+						""" we use literal_eval to deserialize a tuple as keys are tuples """
+					except ValueError:
+						print('could not parse the line `%s` in %s' % (line, filename), file=sys.stderr)
+						sys.exit(1)
+				
+	except IOError:
+		print('file %s does not exist -> will create it.' % filename, file=sys.stderr)
+	return color_entries
+
+def write_color_entries(filename: str, color_entries: t.Mapping[t.Any, int]):
+	with open(filename,'w') as txtfile:
+		print('# this file is automatically created by sqlplot.py to ensure the same legend symbol for each entry in all plots generated by sqlplot.py', file=txtfile)
+		for key in color_entries:
+			txtfile.write('%s\t%d\n' % (key, color_entries[key]))
+
+class ColorCache:
+	""" maps the name of a series to its index in the cycle list, such that a series has the same legend symbol in all plots.
+	This class keeps the entries in memory. Its subclasses store them in a file, which is read only once a plot needs a color
+	"""
+	loaded : t.Optional[t.Dict[t.Any, int]]
+
+	def __init__(self, entries: t.Optional[t.Dict[t.Any, int]] = None):
+		self.loaded = entries
+
+	def load(self) -> t.Dict[t.Any, int]:
+		return dict()
+
+	def entries(self) -> t.Dict[t.Any, int]:
+		if self.loaded == None:
+			self.loaded = self.load()
+		return self.loaded
+
+	def assign(self, entry: t.Any) -> int:
+		""" returns the index of a new entry """
+		return len(self.entries())+1
+
+	def color(self, entry: t.Any) -> int:
+		""" returns the index of an entry, which is assigned on its first use """
+		entries = self.entries()
+		if entry not in entries:
+			entries[entry] = self.assign(entry)
+		return entries[entry]
+
+	def merge(self, entries: t.Mapping[t.Any, int]):
+		""" adds the entries that are not yet known with their given indices """
+		for entry in entries:
+			self.entries().setdefault(entry, entries[entry])
+
+	def export(self, filename: str):
+		""" writes the entries to a text file in the format of pgf_color_entries.txt """
+		write_color_entries(filename, self.entries())
+
+	def save(self):
+		pass
 
+	def close(self):
+		pass
 
+class TextColorCache(ColorCache):
+	""" stores the entries in a text file like pgf_color_entries.txt, which is rewritten in full by `save` """
+	filename : str
+
+	def __init__(self, filename: str):
+		super().__init__()
+		self.filename = filename
+
+	def load(self) -> t.Dict[t.Any, int]:
+		return read_color_entries(self.filename)
+
+	def save(self):
+		if self.loaded != None:
+			write_color_entries(self.filename, self.loaded)
+
+""" table of the color database storing for each entry (serialized with repr) its index """
+COLOR_TABLE = 'sqlplot_colors'
+""" seconds a run waits for the lock of the color database held by a concurrent run """
+COLOR_DATABASE_TIMEOUT = 60
+
+class DatabaseColorCache(ColorCache):
+	""" stores the entries in the table COLOR_TABLE of a SQLite database, which concurrent runs of sqlplot can share.
+	Each new entry is added in its own transaction, which takes the next free index unless a concurrent run has added the entry meanwhile
+	"""
+	databasename : str
+	conn : t.Optional[sqlite3.Connection]
+
+	def __init__(self, databasename: str):
+		super().__init__()
+		self.databasename = databasename
+		self.conn = None
+
+	def connect(self) -> sqlite3.Connection:
+		if self.conn == None:
+			""" without an isolation level, we start the transactions ourselves: BEGIN IMMEDIATE waits for the write lock up to the timeout """
+			self.conn = sqlite3.connect(self.databasename, timeout=COLOR_DATABASE_TIMEOUT, isolation_level=None)
+			self.conn.execute('CREATE TABLE IF NOT EXISTS "%s" (entry TEXT PRIMARY KEY, color INTEGER NOT NULL);' % COLOR_TABLE)
+		return self.conn
+
+	def load(self) -> t.Dict[t.Any, int]:
+		from ast import literal_eval
+		rows = self.connect().execute('SELECT entry, color FROM "%s" ORDER BY color;' % COLOR_TABLE).fetchall()
+		return dict(map(lambda row: (literal_eval(row[0]), row[1]), rows))
+
+	def write(self, sqlcommand: str, rows: t.Iterable[t.Sequence[t.Any]]):
+		conn = self.connect()
+		conn.execute('BEGIN IMMEDIATE;')
+		try:
+			conn.executemany(sqlcommand, rows)
+			conn.execute('COMMIT;')
+		except BaseException:
+			conn.execute('ROLLBACK;')
+			raise
+
+	def assign(self, entry: t.Any) -> int:
+		self.write('INSERT OR IGNORE INTO "%s" (entry, color) SELECT ?, coalesce(max(color), 0) + 1 FROM "%s";' % (COLOR_TABLE, COLOR_TABLE), [(repr(entry),)])
+		return self.connect().execute('SELECT color FROM "%s" WHERE entry = ?;' % COLOR_TABLE, (repr(entry),)).fetchone()[0]
+
+	def merge(self, entries: t.Mapping[t.Any, int]):
+		self.write('INSERT OR IGNORE INTO "%s" (entry, color) VALUES (?, ?);' % COLOR_TABLE, map(lambda entry: (repr(entry), entries[entry]), entries))
+		self.loaded = None
+
+	def export(self, filename: str):
+		""" writes the entries including those added by concurrent runs """
+		self.loaded = None
+		super().export(filename)
+
+	def close(self):
+		if self.conn != None:
+			self.conn.close()
+			self.conn = None
+
+def open_color_cache(filename: str) -> ColorCache:
+	""" a file ending with .txt is read and written as text file, any other file is a SQLite database """
+	if filename.endswith('.txt'):
+		return TextColorCache(filename)
+	return DatabaseColorCache(filename)
+
+
+def sqlexecute(sqlcommand: str, parameters: t.Sequence[t.Any] = ()):
+	try:
+		logging.debug("SQL query: " + sqlcommand);
+		engine().cursor.execute(sqlcommand, parameters)
+	except sqlite3.Error as e:
+		print("Error while executing the SQL statement: ", sqlcommand, file=sys.stderr)
+		raise e
 
-def sqlexecute(sqlcommand: str):
+def sqlexecutemany(sqlcommand: str, rows: t.Iterable[t.Sequence[t.Any]]):
 	try:
-		logging.debug("SQL query: " + sqlbuffer);
-		cursor.execute(sqlcommand)
+		logging.debug("SQL query (batched): " + sqlcommand);
+		engine().cursor.executemany(sqlcommand, rows)
 	except sqlite3.Error as e:
 		print("Error while executing the SQL statement: ", sqlcommand, file=sys.stderr)
 		raise e
@@ -260,25 +1449,522 @@ class Macro:
 	name : str
 	arguments : t.List[str]
 	body : str
+	""" matches the arguments in the body """
+	argument_pattern : t.Pattern[str]
+	""" the memoized expansions by their parameters, with the macros called by each expansion """
+	expansions : t.Dict[t.Tuple[str, ...], t.Tuple[str, t.List[t.Tuple[str, "Macro"]]]]
 
 	def __init__(self, name: str, arguments: t.List[str], body: str):
 		self.name = name
 		self.arguments = arguments
 		self.body = body
+		self.argument_pattern = re.compile(r'\$(%s)(?!\w)' % '|'.join(map(re.escape, arguments)))
+		self.expansions = dict()
+
+	def substitute(self, parameters: t.Sequence[str]) -> str:
+		""" returns the body with the arguments replaced by the given list of parameters """
+		assert len(parameters) == len(self.arguments), "length of arguments and parameters for macro %s mismatch: %s" % (self.name, list(parameters))
+		values = dict(zip(self.arguments, parameters))
+		return self.argument_pattern.sub(lambda match: values[match.group(1)], self.body)
+
+def parse_macro(sqlbuffer: str) -> Macro:
+	""" parses a DEFINE directive """
+	match = re.match(r'\s*DEFINE\s+(\w+)\s*\(([^)]+)\)\s*(.*)', sqlbuffer)
+	assert match, "no valid MACRO: " + sqlbuffer
+	name = match.group(1)
+	arguments = list(map(lambda x: x.strip(), match.group(2).split(',')))
+	body = match.group(3)
+	for argument in arguments:
+		assert body.find('$' + argument) != -1, "argument %s not found in body: %s" % (argument, body)
+	return Macro(name, arguments, body)
+
+
+class Directive:
+	""" a part of a document as parsed by parse_document. `lines` are the lines of the document it spans, which are printed unchanged to the processed document """
+	lines : t.List[str]
+
+	def __init__(self, lines: t.List[str]):
+		self.lines = lines
+
+class TextDirective(Directive):
+	""" lines without a directive """
+
+class ImportDirective(Directive):
+	""" an IMPORT-DATA, IMPORT-JSON-DATA or IMPORT-CSV-DATA line, whose file is imported before the document is processed """
+	job : ImportJob
+
+	def __init__(self, lines: t.List[str], job: ImportJob):
+		super().__init__(lines)
+		self.job = job
+
+class MacroDirective(Directive):
+	""" a DEFINE directive """
+	macro : Macro
+
+	def __init__(self, lines: t.List[str], macro: Macro):
+		super().__init__(lines)
+		self.macro = macro
+
+class UndefDirective(Directive):
+	""" an UNDEF line removing the macro `name` """
+	name : str
+
+	def __init__(self, lines: t.List[str], name: str):
+		super().__init__(lines)
+		self.name = name
+
+class QueryDirective(Directive):
+	""" a directive running a query. `text` is the directive with its comment lines joined,
+	`sql` the query following the keyword and its arguments, and `config` the arguments of its CONFIG line
+	"""
+	status : ReadStatus
+	text : str
+	sql : str
+	config : t.Dict[str, str]
+
+	def __init__(self, lines: t.List[str], status: ReadStatus, text: str, sql: str, config: t.Dict[str, str]):
+		super().__init__(lines)
+		self.status = status
+		self.text = text
+		self.sql = sql
+		self.config = config
+
+	def query(self, macrotable: t.Mapping[str, Macro]) -> str:
+		""" the SQL executed for this directive with the macros of `macrotable` """
+		return apply_macros(self.sql, macrotable)
+
+class PlotDirective(QueryDirective):
+	""" a MULTIPLOT directive grouping the series by `columns`, or a SINGLEPLOT directive of the series `name` """
+	columns : t.List[str]
+	name : t.Optional[str]
+
+	def __init__(self, lines: t.List[str], status: ReadStatus, text: str, config: t.Dict[str, str]):
+		match = re.match(r'\s*%s\(([^)]+)\)' % status.name, text)
+		assert match, "no %s argument given: %s" % (status.name.lower(), text)
+		super().__init__(lines, status, text, text[match.span()[1]:], config)
+		if status == ReadStatus.MULTIPLOT:
+			self.columns = list(map(lambda col: col.strip(), match.group(1).split(',')))
+			self.name = None
+		else:
+			self.columns = []
+			self.name = match.group(1)
+
+	def query(self, macrotable: t.Mapping[str, Macro]) -> str:
+		if self.name != None:
+			return self.sql
+		return multiplot_query(apply_macros(self.sql, macrotable), self.columns)
+
+class TabularDirective(QueryDirective):
+	""" a TABULAR directive """
+
+class MatrixDirective(QueryDirective):
+	""" a MATRIX directive """
+
+def query_directive(lines: t.List[str], status: ReadStatus, text: str, config: t.Dict[str, str]) -> QueryDirective:
+	if status in [ReadStatus.MULTIPLOT, ReadStatus.SINGLEPLOT]:
+		return PlotDirective(lines, status, text, config)
+	sql = text[text.find(status.name)+len(status.name):]
+	if status == ReadStatus.TABULAR:
+		return TabularDirective(lines, status, text, sql, config)
+	assert status == ReadStatus.MATRIX
+	return MatrixDirective(lines, status, text, sql, config)
+
+def parse_lines(texlines: t.Iterable[str], filetype: "Filetype") -> t.List[Directive]:
+	""" parses the lines of a document into its directives.
+	A directive spans all subsequent comment lines. It ends at the first other line, which starts the old output of the directive
+	that is erased up to the next empty or comment line. A directive that is not ended before the end of the document is kept as text.
+	"""
+	comment = filetype.comment()
+	keyword_pattern = re.compile('%s (%s)' % (re.escape(comment), '|'.join(keyword_to_status)))
+	config_prefix = comment + ' CONFIG'
+	undef_prefix = comment + ' UNDEF '
+	directives : t.List[Directive] = []
+	readstatus = ReadStatus.NONE
+	block : t.List[str] = []
+	sqlbuffer = ''
+	config : t.Dict[str, str] = dict()
+
+	def add_text(texLine: str):
+		if len(directives) == 0 or type(directives[-1]) != TextDirective:
+			directives.append(TextDirective([]))
+		directives[-1].lines.append(texLine)
+
+	for texLine in texlines:
+		if readstatus == ReadStatus.MACRO:
+			if texLine.startswith(comment):
+				block.append(texLine)
+				sqlbuffer += ' ' + texLine[len(comment):].rstrip()
+				continue
+			readstatus = ReadStatus.NONE
+			directives.append(MacroDirective(block, parse_macro(sqlbuffer)))
+
+		if readstatus in [ReadStatus.MULTIPLOT, ReadStatus.TABULAR, ReadStatus.SINGLEPLOT, ReadStatus.MATRIX]:
+			if texLine.startswith(comment):
+				block.append(texLine)
+				if texLine.startswith(config_prefix):
+					config = dict(split_keyvalueline(texLine[len(config_prefix):]))
+				else:
+					sqlbuffer += ' ' + texLine[len(comment):].rstrip()
+				continue
+			directives.append(query_directive(block, readstatus, sqlbuffer, config))
+			readstatus = ReadStatus.ERASE
+
+		if readstatus == ReadStatus.ERASE:
+			if len(texLine.strip()) == 0 or texLine.startswith(comment):
+				readstatus = ReadStatus.NONE
+			else:
+				continue
+
+		#! check for a multiline command stored in keyword_to_status
+		match = keyword_pattern.match(texLine)
+		if match:
+			readstatus = keyword_to_status[match.group(1)]
+			block = [texLine]
+			sqlbuffer = texLine[len(comment):].rstrip()
+			config = dict()
+			continue
+
+		if texLine.startswith(undef_prefix):
+			match = re.match(r'UNDEF\s+(\w+)\s*', texLine[len(comment):].strip())
+			assert match, 'invalid UNDEF syntax : ' + texLine[len(comment):].strip()
+			directives.append(UndefDirective([texLine], match.group(1).strip()))
+			continue
+
+		job = ImportJob.parse(texLine[len(comment)+1:]) if texLine.startswith(comment + ' ') else None
+		if job != None:
+			directives.append(ImportDirective([texLine], job))
+			continue
+
+		add_text(texLine)
+
+	if readstatus in [ReadStatus.MULTIPLOT, ReadStatus.TABULAR, ReadStatus.SINGLEPLOT, ReadStatus.MATRIX, ReadStatus.MACRO]:
+		for texLine in block:
+			add_text(texLine)
+	return directives
+
+def parse_document(filename: str, filetype: "Filetype") -> t.List[Directive]:
+	""" returns the directives of a document. A document is parsed again only if its contents have changed """
+	with open(filename, 'rb') as texfile:
+		contents = texfile.read()
+	digest = hashlib.sha1(contents).hexdigest()
+	key = (os.path.realpath(filename), filetype)
+	document_plans = engine().document_plans
+	if key in document_plans and document_plans[key][0] == digest:
+		return document_plans[key][1]
+	directives = parse_lines(io.TextIOWrapper(io.BytesIO(contents)), filetype)
+	document_plans[key] = (digest, directives)
+	return directives
+
+
+def file_mode(filename: str) -> int:
+	""" the permissions of the file `filename`, or those a new file gets from open() under the current umask """
+	if os.path.exists(filename):
+		return os.stat(filename).st_mode & 0o7777
+	umask = os.umask(0)
+	os.umask(umask)
+	return 0o666 & ~umask
+
+class OutputFiles:
+	""" the files written by CONFIG file=... are first written to temporary files.
+	On finish, a temporary file replaces its target only if the contents differ, such that unchanged outputs keep their mtime.
+	"""
+	temporaries : t.Dict[str, str]
+
+	def __init__(self, temporaries: t.Optional[t.Dict[str, str]] = None):
+		self.temporaries = temporaries if temporaries != None else dict()
+
+	def open(self, filename: str, mode: str) -> t.IO:
+		if not filename in self.temporaries:
+			if os.path.dirname(filename):
+				os.makedirs(os.path.dirname(filename), exist_ok=True)
+			fd, temporary = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', prefix='.%s.' % os.path.basename(filename), suffix='.tmp')
+			os.close(fd)
+			if mode.find('a') != -1 and os.path.exists(filename):
+				shutil.copyfile(filename, temporary)
+			self.temporaries[filename] = temporary
+		return open(self.temporaries[filename], mode)
+
+	def finish(self):
+		for filename in self.temporaries:
+			temporary = self.temporaries[filename]
+			if os.path.exists(filename) and filecmp.cmp(filename, temporary, shallow=False):
+				logging.info('output file %s is unchanged' % filename)
+				os.remove(temporary)
+			else:
+				""" mkstemp creates the temporary file readable only by its owner """
+				os.chmod(temporary, file_mode(filename))
+				os.replace(temporary, filename)
+		self.temporaries = dict()
+
+	def discard(self):
+		""" removes the temporary files without replacing their targets """
+		for temporary in self.temporaries.values():
+			if os.path.exists(temporary):
+				os.remove(temporary)
+		self.temporaries = dict()
+
+
+""" seconds between two checks for changed files in watch mode """
+WATCH_INTERVAL = 0.2
+
+def file_states(filenames: t.List[str]) -> t.Dict[str, t.Optional[t.Tuple[int, int]]]:
+	""" maps each file to its size and mtime, or to None if it does not exist """
+	states : t.Dict[str, t.Optional[t.Tuple[int, int]]] = dict()
+	for filename in filenames:
+		try:
+			stat = os.stat(filename)
+			states[filename] = (stat.st_size, stat.st_mtime_ns)
+		except OSError:
+			states[filename] = None
+	return states
+
+def wait_for_changes(filenames: t.List[str], previous_states: t.Dict[str, t.Optional[t.Tuple[int, int]]]):
+	""" polls `filenames` until one of them differs from `previous_states`; files missing in `previous_states` are compared with their current state """
+	states = file_states(filenames)
+	states.update(filter(lambda entry: entry[0] in states, previous_states.items()))
+	while file_states(filenames) == states:
+		time.sleep(WATCH_INTERVAL)
+
+
+def select_kth(values: t.List[t.Any], k: int) -> t.Any:
+	""" returns the k-th smallest value (counting from zero) of a non-empty list in expected linear time (quickselect) """
+	while True:
+		pivot = values[random.randrange(len(values))]
+		smaller = [value for value in values if value < pivot]
+		if k < len(smaller):
+			values = smaller
+			continue
+		equal = sum(1 for value in values if value == pivot)
+		if k < len(smaller) + equal:
+			return pivot
+		k -= len(smaller) + equal
+		values = [value for value in values if value > pivot]
+
+def percentile_of(values: t.List[t.Any], percent: float) -> t.Optional[float]:
+	""" computes the percentile of a list of numbers, interpolating linearly between the two closest ranks """
+	if len(values) == 0:
+		return None
+	assert 0 <= percent <= 100, 'the percentile %s is not within [0,100]' % percent
+	rank = (len(values) - 1) * percent / 100
+	lower = select_kth(values, int(rank))
+	if rank == int(rank):
+		return lower
+	upper = select_kth(values, int(rank) + 1)
+	return lower + (upper - lower) * (rank - int(rank))
+
+class MultisetAggregate:
+	""" base of the aggregates that need all values of a group or window frame; NULL values are skipped """
+	def __init__(self):
+		self.values : t.List[t.Any] = []
+	def step(self, value):
+		if value != None:
+			self.values.append(value)
+	def inverse(self, value):
+		if value != None:
+			self.values.remove(value)
+	def value(self) -> t.Any:
+		""" computes the aggregate of `values` """
+		raise NotImplementedError
+	def finalize(self):
+		return self.value()
+
+class MedianAggregate(MultisetAggregate):
+	""" median(x) """
+	def value(self):
+		return percentile_of(self.values, 50)
+
+class PercentileAggregate(MultisetAggregate):
+	""" percentile(x, p) with p in [0,100] """
+	def __init__(self):
+		super().__init__()
+		self.percent = 50
+	def step(self, value, percent=50):
+		self.percent = percent
+		super().step(value)
+	def inverse(self, value, percent=50):
+		super().inverse(value)
+	def value(self):
+		return percentile_of(self.values, self.percent)
+
+class StddevAggregate:
+	""" stddev(x): the sample standard deviation, maintained with Welford's online algorithm """
+	def __init__(self):
+		self.count = 0
+		self.mean = 0.0
+		self.squares = 0.0
+	def step(self, value):
+		if value == None:
+			return
+		self.count += 1
+		delta = value - self.mean
+		self.mean += delta / self.count
+		self.squares += delta * (value - self.mean)
+	def inverse(self, value):
+		if value == None:
+			return
+		self.count -= 1
+		if self.count == 0:
+			self.mean = 0.0
+			self.squares = 0.0
+			return
+		delta = value - self.mean
+		self.mean -= delta / self.count
+		self.squares -= delta * (value - self.mean)
+	def value(self):
+		if self.count < 2:
+			return None
+		return math.sqrt(max(self.squares, 0.0) / (self.count - 1))
+	def finalize(self):
+		return self.value()
+
+class GeomeanAggregate:
+	""" geomean(x): the geometric mean of positive numbers; zero if a value is zero, NULL if a value is negative """
+	def __init__(self):
+		self.count = 0
+		self.logsum = 0.0
+		self.zeros = 0
+		self.negatives = 0
+	def update(self, value, sign: int):
+		if value == None:
+			return
+		self.count += sign
+		if value > 0:
+			self.logsum += sign * math.log(value)
+		elif value == 0:
+			self.zeros += sign
+		else:
+			self.negatives += sign
+	def step(self, value):
+		self.update(value, 1)
+	def inverse(self, value):
+		self.update(value, -1)
+	def value(self):
+		if self.count == 0 or self.negatives > 0:
+			return None
+		if self.zeros > 0:
+			return 0.0
+		return math.exp(self.logsum / self.count)
+	def finalize(self):
+		return self.value()
+
+class ArgAggregate:
+	""" base of argmin(arg, x) and argmax(arg, x) returning `arg` of the row with the smallest or largest `x` (the first one on ties) """
+	""" picks the row with the smallest or largest `x`: min or max """
+	choose : t.Callable[..., t.Tuple[t.Any, t.Any]]
+	def __init__(self):
+		self.rows : t.List[t.Tuple[t.Any, t.Any]] = []
+	def step(self, arg, value):
+		if value != None:
+			self.rows.append((arg, value))
+	def inverse(self, arg, value):
+		if value != None:
+			self.rows.remove((arg, value))
+	def value(self):
+		if len(self.rows) == 0:
+			return None
+		return self.choose(self.rows, key=lambda row: row[1])[0]
+	def finalize(self):
+		return self.value()
+
+class ArgminAggregate(ArgAggregate):
+	choose = staticmethod(min)
+
+class ArgmaxAggregate(ArgAggregate):
+	choose = staticmethod(max)
+
+STATISTICAL_AGGREGATES : t.Dict[str, t.Tuple[int, t.Any]] = {
+	'median' : (1, MedianAggregate),
+	'percentile' : (2, PercentileAggregate),
+	'stddev' : (1, StddevAggregate),
+	'geomean' : (1, GeomeanAggregate),
+	'argmin' : (2, ArgminAggregate),
+	'argmax' : (2, ArgmaxAggregate),
+	}
+""" the aggregates usable in GROUP BY and as window functions: name -> (number of arguments, class) """
+
+def register_functions(conn: sqlite3.Connection) -> None:
+	""" registers the scalar functions and the statistical aggregates on a connection """
+	conn.create_function("pow", 2, lambda base,exp: math.pow(base, exp))
+	conn.create_function("log", 2, lambda base,x: math.log(x, base))
+	conn.create_function("basename", 1, lambda filepath: os.path.basename(filepath))
+	for name, (arguments, aggregate) in STATISTICAL_AGGREGATES.items():
+		if hasattr(conn, 'create_window_function'):
+			conn.create_window_function(name, arguments, aggregate)
+		else:
+			conn.create_aggregate(name, arguments, aggregate)
 
-	def apply(self, s: str) -> str:
-		""" applies the macro with a given list of parameters """
-		regex = r'\$' + self.name + r'\s*\(([^)]+)\)'
-		match = re.search(regex, s)
-		while match:
-			parameters = match.group(1).split(',')
-			assert len(parameters) == len(self.arguments), "length of arguments and parameters for macro %s mismatch: " % (self.name, parameters)
-			body = self.body
-			for rule in zip(self.arguments, parameters):
-				body = body.replace('$' + rule[0], rule[1])
-			s = re.sub(regex, body, s, 1)
-			match = re.search(regex, s)
-		return s
+
+def downsample(points: t.List[t.Tuple[t.Any, t.Any]], maxpoints: int) -> t.List[t.Tuple[t.Any, t.Any]]:
+	""" selects `maxpoints` of the points of a series with the Largest-Triangle-Three-Buckets algorithm, which keeps peaks and trends visible.
+	The first and the last point are always kept; for each bucket of points in between, we keep the point spanning the largest triangle
+	with the previously kept point and the average of the next bucket.
+	"""
+	if len(points) <= maxpoints:
+		return points
+	try:
+		xs = list(map(lambda point: float(point[0]), points))
+		ys = list(map(lambda point: float(point[1]), points))
+	except (TypeError, ValueError):
+		logging.warning('cannot downsample a series with non-numeric coordinates')
+		return points
+	n = len(points)
+	bucket_size = (n - 2) / (maxpoints - 2)
+	sampled = [points[0]]
+	previous = 0
+	for bucket in range(maxpoints - 2):
+		begin = int(bucket * bucket_size) + 1
+		end = int((bucket + 1) * bucket_size) + 1
+		next_end = min(int((bucket + 2) * bucket_size) + 1, n)
+		if end >= next_end:
+			average_x, average_y = xs[n-1], ys[n-1]
+		else:
+			average_x = sum(xs[end:next_end]) / (next_end - end)
+			average_y = sum(ys[end:next_end]) / (next_end - end)
+		best = begin
+		best_area = -1.0
+		for i in range(begin, end):
+			area = abs((xs[previous] - average_x) * (ys[i] - ys[previous]) - (xs[previous] - xs[i]) * (average_y - ys[previous]))
+			if area > best_area:
+				best_area = area
+				best = i
+		sampled.append(points[best])
+		previous = best
+	sampled.append(points[-1])
+	return sampled
+
+
+def npz_array(values: t.List[t.Any]) -> t.Any:
+	""" converts coordinates into a typed numpy array: integers, floats (None becomes NaN) or strings """
+	import numpy
+	if all(map(lambda value: isinstance(value, int), values)):
+		return numpy.array(values, dtype=numpy.int64)
+	try:
+		return numpy.array(values, dtype=numpy.float64)
+	except (TypeError, ValueError):
+		return numpy.array(list(map(str, values)))
+
+def write_npz(outfile: t.IO, sqlbuffer: str, entrynames: t.List[str], coordinates: t.Mapping[str, t.List[t.Tuple[str,str]]]):
+	""" writes the series into a numpy .npz archive: the arrays `x<i>` and `y<i>` hold the coordinates of the i-th series,
+	`names` holds the JSON-encoded name tuples of the series, and `query` the SQL query. Read it with load_npz
+	"""
+	try:
+		import numpy
+	except ImportError:
+		die('the output type npz requires numpy')
+	arrays = dict()
+	arrays['query'] = numpy.array(sqlbuffer)
+	arrays['names'] = numpy.array(list(map(lambda entryname: json.dumps(list(entryname)), entrynames)))
+	for entry_id in range(len(entrynames)):
+		arrays['x%d' % entry_id] = npz_array(list(map(lambda coordinate: coordinate[0], coordinates[entrynames[entry_id]])))
+		arrays['y%d' % entry_id] = npz_array(list(map(lambda coordinate: coordinate[1], coordinates[entrynames[entry_id]])))
+	numpy.savez(outfile, **arrays)
+
+def load_npz(filename: str) -> t.Dict[t.Tuple[t.Any, ...], t.Tuple[t.Any, t.Any]]:
+	""" reads a file written with CONFIG type=npz into a dictionary mapping the name tuple of each series to its x and y arrays """
+	import numpy
+	with numpy.load(filename) as archive:
+		names = list(map(lambda name: tuple(json.loads(str(name))), archive['names']))
+		return dict(map(lambda entry_id: (names[entry_id], (archive['x%d' % entry_id], archive['y%d' % entry_id])), range(len(names))))
 
 
 """ writes the output of MULTIPLOT or SINGLEPLOT, where coordinates is a dict mapping an entryname to a list of coordinates. Adds to `previous_entries` the number of written entries """
@@ -288,31 +1974,40 @@ def plot_coordinates(sqlbuffer: str,
 		outfile: t.IO, 
 		outfiletype: Filetype, 
 		previous_entries: int) -> int:
+	session = engine()
+	config_args = session.config_args
 	entrynames = list(coordinates.keys())
 	entrynames.sort()
 	sqlbuffer = sqlbuffer.replace('\n', ' ')
 
+	if 'maxpoints' in config_args:
+		maxpoints = int(config_args['maxpoints'])
+		assert maxpoints >= 3, 'maxpoints must be at least 3'
+		coordinates = dict(map(lambda entry: (entry, downsample(coordinates[entry], maxpoints)), entrynames))
+
 	if outfiletype == Filetype.PYTHON:
 		pprint.pprint(coordinates, outfile)
+	elif outfiletype == Filetype.NPZ:
+		write_npz(outfile, sqlbuffer, entrynames, coordinates)
 	elif outfiletype == Filetype.GNUPLOT:
-		if outfilename not in gnuplot_line_index:
-			gnuplot_line_index[outfilename] = 0
+		if outfilename not in session.gnuplot_line_index:
+			session.gnuplot_line_index[outfilename] = 0
 		print('# ' + sqlbuffer, file=outfile)
 		print('', file=outfile)
 		for entry_id in range(len(entrynames)):
 			entryname = entrynames[entry_id]
-			print('#index %d with parameter %s' % (gnuplot_line_index[outfilename], entryname[0] if len(entryname) == 1 else str(entryname).replace(',',';')), file=outfile)
+			print('#index %d with parameter %s' % (session.gnuplot_line_index[outfilename], entryname[0] if len(entryname) == 1 else str(entryname).replace(',',';')), file=outfile)
 			for coordinate in coordinates[entryname]:
 				print('%s\t%s' % (coordinate[0], coordinate[1]), file=outfile)
 			""" gnuplot needs two newlines for marking the values of the next entry """
 			print('', file=outfile)
 			print('', file=outfile)
-			gnuplot_line_index[outfilename] += 1
+			session.gnuplot_line_index[outfilename] += 1
 			
 		print('# plot \\', file=outfile)
 		for entry_id in range(len(entrynames)):
 			entryname = entrynames[entry_id]
-			index = gnuplot_line_index[outfilename] - len(entrynames) + entry_id
+			index = session.gnuplot_line_index[outfilename] - len(entrynames) + entry_id
 			title = entryname[0] if len(entryname) == 1 else str(entryname).replace(',',';')
 			print('# \'%s\' index %d title "%s" with linespoints ls %d, \\' % (outfilename, index, title, index+1), file=outfile)
 		print('# ', file=outfile)
@@ -326,19 +2021,15 @@ def plot_coordinates(sqlbuffer: str,
 			for coordinate in coordinates[entryname]:
 				print('%s,%f,%f' % (entryname[0] if len(entryname) == 1 else str(entryname).replace(',',';'), coordinate[0], coordinate[1]), file=outfile)
 	elif outfiletype == Filetype.JS:
+		""" columnar layout: one record per series with the arrays of its x and y coordinates """
 		jsonoutput=dict()
 		jsonoutput['query'] = sqlbuffer
-		j=[]
-		for entry_id in range(len(entrynames)):
-			entryname = entrynames[entry_id]
-			for coordinate in coordinates[entryname]:
-				entry = dict()
-				entry['name'] = entryname
-				entry['x'] = coordinate[0]
-				entry['y'] = coordinate[1]
-				j.append(entry)
-		jsonoutput['result'] = j
-		json.dump(jsonoutput, outfile, indent=1)
+		jsonoutput['series'] = list(map(lambda entryname: {
+			'name' : entryname,
+			'x' : list(map(lambda coordinate: coordinate[0], coordinates[entryname])),
+			'y' : list(map(lambda coordinate: coordinate[1], coordinates[entryname])),
+			}, entrynames))
+		json.dump(jsonoutput, outfile, separators=(',', ':'))
 	else: # default: latex
 		if outfilename != 'stdout':
 			print('% ' + sqlbuffer, file=outfile)
@@ -346,10 +2037,9 @@ def plot_coordinates(sqlbuffer: str,
 		for entry_id in range(len(entrynames)):
 			entry = entrynames[entry_id]
 			if not 'colorcache' in config_args or config_args['colorcache'] != 'none':
-				if entry not in color_entries:
-					color_entries[entry] = len(color_entries)+1
-				shift = color_entries[entry]-(entry_id+previous_entries)
-				print('\\pgfplotsset{cycle list shift=%d} %% %s' % (shift, str(color_entries[entry])), file=outfile)
+				color = session.colors.color(entry)
+				shift = color-(entry_id+previous_entries)
+				print('\\pgfplotsset{cycle list shift=%d} %% %s' % (shift, str(color)), file=outfile)
 			print('\\addplot coordinates{%s};' % ' '.join(map(lambda coord: '(%s, %s)' % (coord[0], coord[1]), coordinates[entry])), file=outfile)
 			print('\\addlegendentry{%s};' % (str(entry) if len(entry) > 1 else entry[0]), file=outfile)
 		previous_entries = previous_entries + len(entrynames) # number of previous entries -> needed for a subsequent plot call to determine the cycle list correctly
@@ -364,29 +2054,421 @@ def print_tablentry(entry: t.Any) -> str:
 		return "\\num{%s}" % entry
 	return str(entry)
 
+def write_tabular(rows: t.Iterable[t.Tuple[t.Any, ...]], outfile: t.IO):
+	""" writes the rows of a TABULAR query as they arrive """
+	count = 0
+	for row in rows:
+		print(" & ".join(map(print_tablentry, row)) + ' \\\\', file=outfile)
+		count += 1
+	profile('rows_returned', count)
+
+def write_matrix(rows: t.Iterable[t.Tuple[t.Any, t.Any, t.Any]], outfile: t.IO):
+	""" pivots the rows (x, y, val) of a MATRIX query in a single pass.
+	The columns and the rows of the matrix are ordered by the first occurrence of their `x` and `y` values, and a missing cell is written as NONE
+	"""
+	columns : t.Dict[t.Any, None] = dict()
+	matrix : t.Dict[t.Any, t.Dict[t.Any, t.Any]] = dict()
+	count = 0
+	for x, y, val in rows:
+		columns.setdefault(x)
+		matrix.setdefault(y, dict())[x] = val
+		count += 1
+	print(" & ".join(map(str, columns)) + ' \\\\', file=outfile)
+	for y, cells in matrix.items():
+		print(str(y) + " & " + " & ".join(map(lambda x: print_tablentry(cells.get(x)), columns)) + ' \\\\', file=outfile)
+	profile('rows_returned', count)
+
+
+class Engine:
+	""" a session of sqlplot owning a database connection, the macros, the color entries and the further state of processing documents.
+	The functions of this module work on the engine returned by engine(), which is set for the current thread by `activate` and by the methods of Engine.
+	Hence, several documents can be rendered by one or more engines in the same process
+	"""
+	conn : sqlite3.Connection
+	cursor : sqlite3.Cursor
+	colors : ColorCache
+	""" mapping names to macros """
+	macros : t.Dict[str, Macro]
+	""" the key-value pairs of the CONFIG line of the directive being processed """
+	config_args : t.Mapping[str,str]
+	""" storing the last index of the written gnuplot data for each file """
+	gnuplot_line_index : t.Dict[str, int]
+	""" set by the --profile program parameter """
+	profiler : t.Optional[Profiler]
+	""" whether the database outlives the current run (a database file or the connection kept by --watch); otherwise the import cache stores no content hashes """
+	persistent : bool
+	""" whether query results are cached in the database; only useful if the database persists between runs """
+	result_cache_enabled : bool
+	""" if set, new query results are collected here as (key, pickled result) instead of being written into the database, as done on read-only connections """
+	result_cache_pending : t.Optional[t.List[t.Tuple[str, bytes]]]
+	""" the pool running the queries of the document being processed, if any """
+	query_pool : t.Optional[QueryPool]
+	""" the directives of the documents parsed by this engine by their path and file type, together with the digest of the contents they were parsed from.
+	Only the directives of the latest contents of a document are kept
+	"""
+	document_plans : t.Dict[t.Tuple[str, Filetype], t.Tuple[str, t.List[Directive]]]
+
+	def __init__(self, databasename: str = ':memory:', colors: t.Optional[ColorCache] = None, conn: t.Optional[sqlite3.Connection] = None):
+		""" opens the database `databasename` with the functions of sqlplot, unless an open connection `conn` is given.
+		The color entries are by default stored in the file pgf_color_entries.txt
+		"""
+		if conn == None:
+			conn = sqlite3.connect(databasename)
+			conn.row_factory = sqlite3.Row
+			register_functions(conn)
+		self.conn = conn
+		self.cursor = conn.cursor()
+		self.colors = colors if colors != None else TextColorCache(COLOR_ENTRIES_FILE)
+		self.macros = dict()
+		self.config_args = dict()
+		self.gnuplot_line_index = dict()
+		self.profiler = None
+		self.persistent = databasename != ':memory:'
+		self.result_cache_enabled = self.persistent
+		self.result_cache_pending = None
+		self.query_pool = None
+		self.document_plans = dict()
+
+	@contextlib.contextmanager
+	def activate(self) -> t.Iterator["Engine"]:
+		""" lets the functions of this module work on this engine within the current thread """
+		token = active_engine.set(self)
+		try:
+			yield self
+		finally:
+			active_engine.reset(token)
+
+	def import_data(self, jobs: t.List[ImportJob], processes: int = 1) -> t.Set[str]:
+		""" imports the files of IMPORT directives, see import_all """
+		with self.activate():
+			return import_all(jobs, processes)
+
+	def render(self, filename: str, output: t.Optional[t.IO] = None, processes: int = 1, output_files: t.Optional[OutputFiles] = None):
+		""" imports the data of a document, indexes the imported tables for its queries, and writes the processed document to `output` (by default stdout).
+		The files of CONFIG file=... are written via `output_files`; if not given, they are replaced once the document has been processed
+		"""
+		filetype = Filetype.fromString(os.path.splitext(filename)[1][1:])
+		own_output_files = output_files == None
+		if output_files == None:
+			output_files = OutputFiles()
+		try:
+			with self.activate(), contextlib.redirect_stdout(output if output != None else sys.stdout):
+				#! import the data of all IMPORT directives before processing the document
+				imported_tables = import_all(document_import_jobs(filename, filetype), processes)
+
+				#! index the imported tables for the filters and groupings of all queries in the document
+				create_indexes(advise_indexes(scan_queries(parse_document(filename, filetype))), imported_tables)
+
+				process_document(filename, filetype, output_files, processes)
+		except BaseException:
+			if own_output_files:
+				output_files.discard()
+			raise
+		if own_output_files:
+			output_files.finish()
+
+	def render_directive(self, text: str, filetype: Filetype = Filetype.TEX, processes: int = 1) -> str:
+		""" processes the directives of `text`, like a single TABULAR directive, and returns the processed text.
+		Unlike a document, the macros defined by `text` are kept for subsequent calls
+		"""
+		texlines = io.StringIO(text).readlines()
+		if len(texlines) > 0 and not texlines[-1].endswith('\n'):
+			texlines[-1] += '\n'
+		""" a directive is run only when a line that is not a comment follows """
+		terminated = len(texlines) > 0 and texlines[-1].startswith(filetype.comment())
+		if terminated:
+			texlines.append('\n')
+		directives = parse_lines(texlines, filetype)
+		output = io.StringIO()
+		output_files = OutputFiles()
+		try:
+			with self.activate(), contextlib.redirect_stdout(output):
+				import_all(import_jobs_of(directives), processes)
+				process_directives(directives, filetype, output_files, processes)
+		except BaseException:
+			output_files.discard()
+			raise
+		output_files.finish()
+		return output.getvalue()[:-1] if terminated else output.getvalue()
+
+	def close(self):
+		self.conn.close()
+		self.colors.close()
+
+""" the engine the functions of this module work on in the current thread """
+active_engine : "contextvars.ContextVar[Engine]" = contextvars.ContextVar('sqlplot_engine')
+
+def engine() -> Engine:
+	""" returns the active engine, see Engine.activate """
+	current = active_engine.get(None)
+	assert current != None, 'no sqlplot engine is active; use Engine.activate'
+	return current
+
+
+def process_document(filename: str, filetype: Filetype, output_files: OutputFiles, threads: int = 1):
+	""" processes the directives of a document, whose imports have already been done, and prints the processed document.
+	The files of CONFIG file=... are written via `output_files`.
+	With more than one of `threads`, the queries are run ahead on a query pool, while the outputs are still written in document order
+	"""
+	session = engine()
+	session.macros = dict()
+	session.gnuplot_line_index = dict()
+	process_directives(parse_document(filename, filetype), filetype, output_files, threads)
+
+def process_directives(directives: t.List[Directive], filetype: Filetype, output_files: OutputFiles, threads: int = 1):
+	""" processes directives read from a file of type `filetype` with the macros defined so far, and prints the processed text, see process_document """
+	session = engine()
+	session.config_args = dict()
+	outfile = sys.stdout
+	outfiletype = Filetype.TEX
+	previous_entries = -1
+
+	session.query_pool = start_query_pool(directives, threads)
+	""" committing new results while the threads of the pool read the database would wait for their locks, hence they are stored once the pool is closed """
+	pending_results : t.List[t.Tuple[str, bytes]] = []
+	if session.query_pool != None and session.result_cache_pending == None:
+		session.result_cache_pending = pending_results
+	try:
+		for directive in directives:
+			print(''.join(directive.lines), end='')
+			if isinstance(directive, MacroDirective):
+				session.macros[directive.macro.name] = directive.macro
+			elif isinstance(directive, UndefDirective):
+				assert directive.name in session.macros, 'cannot UNDEF undefined macro: ' + directive.name
+				del session.macros[directive.name]
+			elif isinstance(directive, QueryDirective):
+				config_args = directive.config
+				session.config_args = config_args
+				if session.profiler != None:
+					session.profiler.start(directive.status.name, directive.text)
+				""" the position in the CONFIG file at which this directive starts writing """
+				outfile_start = 0
+				if isinstance(directive, PlotDirective):
+					outfiletype = filetype
+					""" if mode=a we use the previous_entries for the cycle list """
+					if not 'mode' in config_args or config_args['mode'].find('a') == -1: 
+						previous_entries = 0
+					if 'type' in config_args:
+						outfiletype = Filetype.fromString(config_args['type'])
+					if 'file' in config_args:
+						if outfiletype == Filetype.GNUPLOT:
+							assert ('mode' in config_args and config_args['mode'].find('a') != -1) or config_args['file'] not in session.gnuplot_line_index, 'overwriting a .dat file created within this execution without append mode is prohibited'
+
+						if outfiletype == Filetype.NPZ:
+							assert not 'mode' in config_args or config_args['mode'].find('a') == -1, 'cannot append to the npz file %s' % config_args['file']
+							outfile = output_files.open(config_args['file'], 'wb')
+						else:
+							outfile = output_files.open(config_args['file'], 'w' if not 'mode' in config_args else config_args['mode'])
+						outfile_start = outfile.tell()
+						if outfiletype == Filetype.TEX: 
+							print('\\input{%s}' % config_args['file'])
+						elif outfiletype == Filetype.PYTHON:
+							print('# read comments in file %s for the plot command' % config_args['file'])
+						elif outfiletype == Filetype.NPZ:
+							print('# read the series of file %s with sqlplot.load_npz' % config_args['file'])
+
+					else:
+						outfile = sys.stdout
+						assert outfiletype != Filetype.GNUPLOT and outfiletype != Filetype.NPZ, "need CONFIG file={outfile} parameter to know where to write the data"
+					if previous_entries == -1:
+						die('mode is set to append, but there is no previous content!')
+
+				if isinstance(directive, TabularDirective) or isinstance(directive, MatrixDirective):
+					sqlbuffer = directive.query(session.macros)
+					if 'file' in config_args:
+						outfile = output_files.open(config_args['file'], 'w' if not 'mode' in config_args else config_args['mode'])
+						outfile_start = outfile.tell()
+						print('\\input{%s}' % config_args['file'])
+					else:
+						outfile = sys.stdout
+
+					if isinstance(directive, TabularDirective):
+						def compute_tabular() -> t.Iterator[t.Tuple[t.Any, ...]]:
+							return (tuple(row) for batch in query_batches(sqlbuffer) for row in batch)
+						write_tabular(cached_query(sqlbuffer, config_args, compute_tabular), outfile)
+					else:
+						def compute_matrix() -> t.Iterator[t.Tuple[t.Any, t.Any, t.Any]]:
+							return ((row['x'], row['y'], row['val']) for batch in query_batches(sqlbuffer) for row in batch)
+						write_matrix(cached_query(sqlbuffer, config_args, compute_matrix), outfile)
+				elif isinstance(directive, PlotDirective) and directive.name != None:
+					sqlbuffer = directive.sql
+					def compute_singleplot() -> t.List[t.Tuple[t.Any, t.Any]]:
+						return list(map(lambda row: (row['x'], row['y']), query_rows(sqlbuffer)))
+					coordinates=dict()
+					coordinates[(directive.name,)] = cached_query(sqlbuffer, config_args, compute_singleplot)
+					previous_entries = plot_coordinates(sqlbuffer, config_args['file'] if 'file' in config_args else 'stdout', coordinates, outfile, outfiletype, previous_entries)
+				else:
+					assert isinstance(directive, PlotDirective)
+					coordinates = multiplot(directive.sql, directive.columns)
+					previous_entries = plot_coordinates(directive.text, config_args['file'] if 'file' in config_args else 'stdout', coordinates, outfile, outfiletype, previous_entries)
+				#cleanup
+				if 'file' in config_args:
+					profile('bytes_written', outfile.tell() - outfile_start)
+					outfile.close()
+				if session.profiler != None:
+					session.profiler.finish()
+				session.config_args = dict()
+	finally:
+		if session.query_pool != None:
+			session.query_pool.close()
+			session.query_pool = None
+		if session.result_cache_pending is pending_results:
+			session.result_cache_pending = None
+	store_query_results(pending_results)
+
+
+def import_jobs_of(directives: t.Iterable[Directive]) -> t.List[ImportJob]:
+	""" returns the jobs of the IMPORT directives among `directives` """
+	return [directive.job for directive in directives if isinstance(directive, ImportDirective)]
+
+def document_import_jobs(filename: str, filetype: Filetype) -> t.List[ImportJob]:
+	""" returns the IMPORT directives of a document """
+	return import_jobs_of(parse_document(filename, filetype))
+
+""" the file types of the documents read from an input directory """
+DOCUMENT_FILETYPES = [ Filetype.TEX, Filetype.PYTHON ]
+
+def input_documents(paths: t.List[str], outdir: t.Optional[str]) -> t.List[t.Tuple[str, str]]:
+	""" expands the input files and directories into the documents to process.
+	Returns for each document its path and the name of the processed document relative to the output directory.
+	A directory contributes its tex and py files recursively in sorted order, except for those in the output directory
+	"""
+	documents : t.List[t.Tuple[str, str]] = []
+	for path in paths:
+		if not os.path.isdir(path):
+			documents.append((path, os.path.basename(path)))
+			continue
+		for directory, subdirectories, filenames in os.walk(path):
+			subdirectories.sort()
+			if outdir != None and os.path.realpath(directory) == os.path.realpath(outdir):
+				subdirectories.clear()
+				continue
+			for name in sorted(filenames):
+				if not name.startswith('.') and Filetype.fromString(os.path.splitext(name)[1][1:]) in DOCUMENT_FILETYPES:
+					documents.append((os.path.join(directory, name), os.path.relpath(os.path.join(directory, name), path)))
+	return documents
+
+def document_worker(databasename: str, filename: str, target: str, known_colors: t.Dict[t.Any, int], result_cache: bool, profiling: bool
+		) -> t.Tuple[t.Dict[str, str], t.List[t.Tuple[t.Any, int]], t.List[t.Tuple[str, bytes]], t.List[t.Dict[str, t.Any]]]:
+	""" runs in a worker process: processes a document on a read-only connection to the database holding the imports, and writes it to `target`.
+	The outputs are left in temporary files. Returns these temporary files, the color entries added to `known_colors`,
+	the new query results to cache, and the profile records
+	"""
+	worker = Engine(colors=ColorCache(dict(known_colors)), conn=connect_readonly(databasename))
+	worker.profiler = Profiler() if profiling else None
+	worker.result_cache_enabled = result_cache
+	worker.result_cache_pending = []
+	output_files = OutputFiles()
+	try:
+		with output_files.open(target, 'w') as document, contextlib.redirect_stdout(document), worker.activate():
+			process_document(filename, Filetype.fromString(os.path.splitext(filename)[1][1:]), output_files)
+	except BaseException:
+		output_files.discard()
+		raise
+	finally:
+		worker.close()
+	new_colors = list(filter(lambda entry: entry[0] not in known_colors, worker.colors.entries().items()))
+	records : t.List[t.Dict[str, t.Any]] = []
+	if worker.profiler != None:
+		records = list(map(lambda record: dict(record, document=filename), worker.profiler.records))
+	return output_files.temporaries, new_colors, worker.result_cache_pending, records
+
+def process_documents(documents: t.List[t.Tuple[str, str]], outdir: str, databasename: str, processes: int):
+	""" processes several documents, each written to `outdir`. The files of the IMPORT directives of all documents are imported once into
+	the database `databasename`, and the documents are then processed by a pool of `processes` worker processes on read-only connections.
+	The color entries of the series first plotted by a document are merged in the order of the documents, as in a sequential run.
+	A document that plotted new series with other colors than the merged ones is processed again with the merged color entries.
+	"""
+	session = engine()
+	import_jobs : t.List[ImportJob] = []
+	queries : t.List[t.Tuple[str, t.List[str], t.Dict[str, str]]] = []
+	for filename, target in documents:
+		filetype = Filetype.fromString(os.path.splitext(filename)[1][1:])
+		import_jobs += document_import_jobs(filename, filetype)
+		queries += scan_queries(parse_document(filename, filetype))
+	imported_tables = import_all(import_jobs, processes)
+	create_indexes(advise_indexes(queries), imported_tables)
+	create_result_cache()
+	session.conn.commit()
+
+	pending = list(range(len(documents)))
+	with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(processes, len(documents)))) as pool:
+		while len(pending) > 0:
+			known_colors = dict(session.colors.entries())
+			futures = list(map(lambda index: pool.submit(document_worker, databasename, documents[index][0], os.path.join(outdir, documents[index][1]),
+				known_colors, session.result_cache_enabled, session.profiler != None), pending))
+			outcomes = []
+			failure : t.Optional[BaseException] = None
+			for future in futures:
+				try:
+					outcomes.append(future.result())
+				except BaseException as error:
+					failure = failure or error
+			if failure != None:
+				for outcome in outcomes:
+					OutputFiles(outcome[0]).discard()
+				raise failure
+
+			rejected = []
+			for index, (temporaries, new_colors, results, records) in zip(pending, outcomes):
+				merged_colors = list(map(lambda entry: session.colors.color(entry[0]), new_colors))
+				if merged_colors == list(map(lambda entry: entry[1], new_colors)):
+					OutputFiles(temporaries).finish()
+				else:
+					logging.info('processing %s again with the color entries of the previous documents' % documents[index][0])
+					OutputFiles(temporaries).discard()
+					rejected.append(index)
+				""" committed right away, since the color entries may be stored in the same database, whose lock they wait for """
+				store_query_results(results)
+				if session.profiler != None:
+					session.profiler.records += records
+			pending = rejected
+
 
 if __name__ == "__main__":
 
 	databasename=':memory:'
 	loging_level_parameter='warning'
-	filename=''
+	filenames : t.List[str] = []
+	outdir = None
 	filetype = Filetype.TEX
 
+	processes = os.cpu_count() or 1
+	profile_filename = None
+	watch_filename = None
+	colors_filename = COLOR_ENTRIES_FILE
+	import_colors_filename = None
+	export_colors_filename = None
+
 	try:
-		opts, args = getopt.getopt(sys.argv[1:],"D:l:i:",["database=","log="])
+		opts, args = getopt.getopt(sys.argv[1:],"D:l:i:j:o:",["database=","log=","jobs=","profile=","watch=","outdir=","colors=","import-colors=","export-colors="])
 	except getopt.GetoptError:
-		print (sys.argv[0] + ' -D <databasename> -l <logginglevel> -i <infile>')
+		print (sys.argv[0] + ' -D <databasename> -l <logginglevel> -j <processes> --profile <reportfile> --watch <outfile> -o <outdir> --colors <colorfile> --import-colors <txtfile> --export-colors <txtfile> -i <infile or directory> [-i ...]')
 		sys.exit(2)
 	for opt, arg in opts:
 		if opt in ('-D', '--database'):
 			databasename = arg
+		elif opt in ('-j', '--jobs'):
+			processes = int(arg)
+		elif opt == '--profile':
+			profile_filename = arg
+		elif opt == '--watch':
+			watch_filename = arg
 		elif opt in ('-l', '--log'):
 			loging_level_parameter = arg
 		elif opt in ('-i', '--infile'):
-			filename = arg
+			filenames.append(arg)
+		elif opt in ('-o', '--outdir'):
+			outdir = arg
+		elif opt == '--colors':
+			colors_filename = arg
+		elif opt == '--import-colors':
+			import_colors_filename = arg
+		elif opt == '--export-colors':
+			export_colors_filename = arg
 		else:
 			assert False, "unhandled option: %s" % arg
-	if filename == '':
+	if len(filenames) == 0:
 		assert False, "need at least the inputfile (-i) as parameter"
 
 	logging_level = getattr(logging, loging_level_parameter.upper(), None)
@@ -394,193 +2476,104 @@ if __name__ == "__main__":
 		raise ValueError('Invalid log level: %s' % loging_level_parameter)
 	logging.basicConfig(level=logging_level)
 
-	readstatus = ReadStatus.NONE
-	sqlbuffer = ''
-
-	assert os.access(filename, os.R_OK), 'cannot read file %s' % filename
-	filetype = Filetype.fromString(os.path.splitext(filename)[1][1:])
-	if filetype == Filetype.UNKNOWN:
-		die("unknown file type of file %s" % filename)
-
-	conn = sqlite3.connect(databasename)
+	for filename in filenames:
+		assert os.access(filename, os.R_OK), 'cannot read file %s' % filename
+	documents = input_documents(filenames, outdir)
+	for filename, target in documents:
+		if Filetype.fromString(os.path.splitext(filename)[1][1:]) == Filetype.UNKNOWN:
+			die("unknown file type of file %s" % filename)
+	if len(documents) == 0:
+		die('no tex or py files in %s' % ', '.join(filenames))
+	if len(documents) > 1 or outdir != None:
+		assert outdir != None, 'need an output directory (-o) for processing several documents'
+		assert watch_filename == None, '--watch can only process a single document'
+
+	""" with --watch, the connection persists between the rebuilds, so the query results of one rebuild can be reused by the next """
+	persistent = databasename != ':memory:' or watch_filename != None
+
+	""" the worker processes of several documents need a database file to share the imports, which is removed at exit """
+	temporary_database = None
+	if databasename == ':memory:' and outdir != None:
+		fd, temporary_database = tempfile.mkstemp(prefix='sqlplot-', suffix='.db')
+		os.close(fd)
+		databasename = temporary_database
+
+	session = Engine(databasename, open_color_cache(colors_filename))
+	if import_colors_filename != None:
+		session.colors.merge(read_color_entries(import_colors_filename))
 	if logging_level <= logging.DEBUG:
 		sqlite3.enable_callback_tracebacks(True)
-		conn.set_trace_callback(print)
-	conn.row_factory = sqlite3.Row
-	conn.create_function("pow", 2, lambda base,exp: math.pow(base, exp))
-	conn.create_function("log", 2, lambda base,x: math.log(x, base))
-	conn.create_function("basename", 1, lambda filepath: os.path.basename(filepath))
-	cursor = conn.cursor()
-
-
-	config_args : t.Mapping[str,str] = dict()
-	outfile = sys.stdout
-	outfilename = None
-	outfiletype = Filetype.TEX
-	previous_entries = -1
-
-	""" mapping names to macros """
-	macros : t.Mapping[str, Macro] = dict()
-
-	""" storing the last index of the written gnuplot data for each file """
-	gnuplot_line_index : t.Dict[str, int] = dict()
-
-	with open(filename) as texfile:
-		for texLine in texfile.readlines():
-			if readstatus == ReadStatus.MACRO:
-				if texLine.startswith(filetype.comment()):
-					print(texLine, end='')
-					sqlbuffer+=' ' + texLine[len(filetype.comment()):].rstrip()
-					continue
-				readstatus = ReadStatus.NONE
-				match = re.match(r'\s*DEFINE\s+(\w+)\s*\(([^)]+)\)\s*(.*)', sqlbuffer)
-				assert match, "no valid MACRO: " + sqlbuffer
-				name = match.group(1)
-				arguments = list(map(lambda x: x.strip(), match.group(2).split(',')))
-				body = match.group(3)
-				for argument in arguments:
-					assert body.find('$' + argument) != -1, "argument %s not found in body: %s" % (argument, body)
-				macros[name] = Macro(name, arguments, body)
-
-			if readstatus in [ReadStatus.MULTIPLOT, ReadStatus.TABULAR, ReadStatus.SINGLEPLOT, ReadStatus.MATRIX]:
-				if texLine.startswith(filetype.comment()):
-					print(texLine, end='')
-					if texLine.startswith('%s CONFIG' % filetype.comment()):
-						config_args = split_keyvalueline(texLine[len('%s CONFIG' % filetype.comment()):])
-					else:
-						sqlbuffer+=' ' + texLine[len(filetype.comment()):].rstrip()
-					continue
-				else:
-					if readstatus in [ReadStatus.MULTIPLOT, ReadStatus.SINGLEPLOT]:
-						outfiletype = filetype
-						""" if mode=a we use the previous_entries for the cycle list """
-						if not 'mode' in config_args or config_args['mode'].find('a') == -1: 
-							previous_entries = 0
-						if 'type' in config_args:
-							outfiletype = Filetype.fromString(config_args['type'])
-						if 'file' in config_args:
-							if outfiletype == Filetype.GNUPLOT:
-								assert ('mode' in config_args and config_args['mode'].find('a') != -1) or config_args['file'] not in gnuplot_line_index, 'overwriting a .dat file created within this execution without append mode is prohibited'
-
-							os.makedirs(os.path.dirname(config_args['file']), exist_ok=True)
-							outfile = open(config_args['file'], 'w' if not 'mode' in config_args else config_args['mode'])
-							if outfiletype == Filetype.TEX: 
-								print('\\input{%s}' % config_args['file'])
-							elif outfiletype == Filetype.PYTHON:
-								print('# read comments in file %s for the plot command' % config_args['file'])
-								
-						else:
-							outfile = sys.stdout
-							assert outfiletype != Filetype.GNUPLOT, "need CONFIG file={outfile} parameter to know where to write the data"
-						# try:
-						# 	previous_entries
-						# except NameError:
-						if previous_entries == -1:
-							die('mode is set to append, but there is no previous content!')
-							
-
-					if readstatus == ReadStatus.TABULAR:
-						readstatus = ReadStatus.ERASE
-						sqlbuffer = apply_macros(sqlbuffer[sqlbuffer.find('TABULAR')+len('TABULAR'):])
-						sqlexecute(sqlbuffer + ';')
-
-						if 'file' in config_args:
-							outfile = open(config_args['file'], 'w' if not 'mode' in config_args else config_args['mode'])
-							print('\\input{%s}' % config_args['file'])
-						else:
-							outfile = sys.stdout
-
-						for row in cursor.fetchall():
-							print(" & ".join(map(print_tablentry, row)) + ' \\\\', file=outfile)
-					elif readstatus == ReadStatus.SINGLEPLOT:
-						readstatus = ReadStatus.ERASE
-						match = re.match(r'\s*SINGLEPLOT\(([^)]+)\)', sqlbuffer)
-						assert match, "no singleplot argument given: " + sqlbuffer
-						singleplot_name = match.group(1)
-						sqlbuffer = sqlbuffer[match.span()[1]:] #remove 'MULTIPLOT(...) directive
-						sqlexecute(sqlbuffer + ';')
-						rows = cursor.fetchall()
-						coordinates=dict()
-						coordinates[(singleplot_name,)] = list(map(lambda row: (row['x'], row['y']), rows))
-						previous_entries = plot_coordinates(sqlbuffer, config_args['file'] if 'file' in config_args else 'stdout', coordinates, outfile, outfiletype, previous_entries)
-					elif readstatus == ReadStatus.MATRIX:
-						readstatus = ReadStatus.ERASE
-						sqlbuffer = apply_macros(sqlbuffer[sqlbuffer.find('MATRIX')+len('MATRIX'):])
-						sqlexecute(sqlbuffer + ';')
-
-						if 'file' in config_args:
-							outfile = open(config_args['file'], 'w' if not 'mode' in config_args else config_args['mode'])
-							print('\\input{%s}' % config_args['file'])
-						else:
-							outfile = sys.stdout
-						
-						column_names=set()
-						row_names=set()
-						matrix=dict()
-						for row in cursor.fetchall():
-							print(row)
-							column_names.add(row['x'])
-							row_names.add(row['y'])
-							matrix[(row['x'], row['y'])] = row['val']
-						print(" & ".join(map(str, column_names)) + ' \\\\', file=outfile)
-						for row in row_names:
-							print(row + " & " + " & ".join(map(print_tablentry, map(lambda x: matrix[(x, row)], column_names))) + ' \\\\', file=outfile)
-					else:
-						assert readstatus == ReadStatus.MULTIPLOT
-						readstatus = ReadStatus.ERASE
-						match = re.match(r'\s*MULTIPLOT\(([^)]+)\)', sqlbuffer)
-						assert match, "no multiplot argument given: " + sqlbuffer
-						multiplot_columns = match.group(1)
-						sqlbuffer_rest = sqlbuffer[match.span()[1]:] #remove 'MULTIPLOT(...) directive
-						coordinates = multiplot(sqlbuffer_rest, list(map(lambda col: col.strip(), multiplot_columns.split(','))))
-						previous_entries = plot_coordinates(sqlbuffer, config_args['file'] if 'file' in config_args else 'stdout', coordinates, outfile, outfiletype, previous_entries)
-					#cleanup
-					if 'file' in config_args:
-						outfile.close()
-					config_args=dict()
-
-			if readstatus == ReadStatus.ERASE:
-				if len(texLine.strip()) == 0 or texLine.startswith(filetype.comment()):
-					readstatus = ReadStatus.NONE
-				else:
-					continue
-
-			#! check for a multiline command stored in keyword_to_status
-			for key in keyword_to_status:
-				if texLine.startswith('%s %s' % (filetype.comment(), key) ):
-					config_args=dict()
-					sqlbuffer = texLine[len(filetype.comment()):].rstrip()
-					readstatus = keyword_to_status[key]
-					break
-
-			if texLine.startswith('%s UNDEF ' % filetype.comment()):
-				sqlbuffer = texLine[len(filetype.comment()):].strip()
-				match = re.match(r'UNDEF\s+(\w+)\s*', sqlbuffer)
-				assert match, 'invalid UNDEF syntax : ' + sqlbuffer
-				name = match.group(1).strip()
-				assert name in macros, 'cannot UNDEF undefined macro: ' + name
-				del macros[name]
-
-			#! read a log file with '^RESULT .*' statements into a sql table
-			if texLine.startswith('%s IMPORT-DATA ' % filetype.comment()):
-				match = re.match('%s IMPORT-DATA ([^ ]+) (.+)' % filetype.comment(), texLine)
-				assert match, 'invalid texLine ' + texLine
-				create_table(match.group(1), match.group(2))
-
-			#! read a list of JSON log statements into a sql table
-			if texLine.startswith('%s IMPORT-JSON-DATA ' % filetype.comment()):
-				match = re.match('%s IMPORT-JSON-DATA ([^ ]+) (.+)' % filetype.comment(), texLine)
-				assert match, 'invalid texLine ' + texLine
-				create_json_table(match.group(1), match.group(2))
-
-			print(texLine, end='')
-				
-	conn.close()
-
-	if filetype == Filetype.TEX:
-		with open('pgf_color_entries.txt','w') as txtfile:
-			print('# this file is automatically created by sqlplot.py to ensure the same legend symbol for each entry in all plots generated by sqlplot.py', file=txtfile)
-			for key in color_entries:
-				txtfile.write('%s\t%d\n' % (key, color_entries[key]))
+		session.conn.set_trace_callback(print)
+	session.persistent = persistent
+	session.result_cache_enabled = persistent
+
+	if outdir != None:
+		if profile_filename != None:
+			session.profiler = Profiler()
+		try:
+			with session.activate():
+				process_documents(documents, outdir, databasename, processes)
+			if any(map(lambda document: Filetype.fromString(os.path.splitext(document[0])[1][1:]) == Filetype.TEX, documents)):
+				session.colors.save()
+			if export_colors_filename != None:
+				session.colors.export(export_colors_filename)
+		finally:
+			session.close()
+			if temporary_database != None:
+				os.remove(temporary_database)
+		if session.profiler != None and profile_filename != None:
+			session.profiler.report(profile_filename)
+		sys.exit(0)
+
+	filename = documents[0][0]
+	filetype = Filetype.fromString(os.path.splitext(filename)[1][1:])
+	output_files = OutputFiles()
+
+	""" the files whose changes trigger a rebuild in watch mode """
+	watched_files = [filename]
+
+	while True:
+		round_started = time.perf_counter()
+		round_states = file_states(watched_files)
+		if profile_filename != None:
+			session.profiler = Profiler()
+		import_jobs : t.List[ImportJob] = []
+		document = sys.stdout if watch_filename == None else output_files.open(watch_filename, 'w')
+		try:
+			with session.activate():
+				import_jobs = document_import_jobs(filename, filetype)
+			session.render(filename, document, processes, output_files)
+			if watch_filename != None:
+				document.close()
+			output_files.finish()
+		except (Exception, SystemExit) as error:
+			if watch_filename == None:
+				raise
+			""" keep watching after an error such that it can be fixed by editing the input """
+			if not isinstance(error, SystemExit):
+				logging.error('rebuilding %s failed: %s' % (filename, error))
+			if session.conn.in_transaction:
+				session.conn.rollback()
+			output_files.discard()
+			session.profiler = None
+
+		if session.profiler != None and profile_filename != None:
+			session.profiler.report(profile_filename)
+
+		if filetype == Filetype.TEX:
+			session.colors.save()
+		if export_colors_filename != None:
+			session.colors.export(export_colors_filename)
+
+		if watch_filename == None:
+			break
+		print('rebuilt %s in %.3f seconds, watching for changes' % (watch_filename, time.perf_counter() - round_started), file=sys.stderr)
+		watched_files = [filename] + list(map(lambda job: job.tablefilename, import_jobs))
+		assert os.path.realpath(watch_filename) not in map(os.path.realpath, watched_files), 'the watch output %s must not be a watched file' % watch_filename
+		try:
+			wait_for_changes(watched_files, round_states)
+		except KeyboardInterrupt:
+			break
+	session.close()
 
 # vim: ts=2